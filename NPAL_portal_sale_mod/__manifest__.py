@@ -81,6 +81,7 @@ Vantaggi Business
         'base',
         'sale',
         'website_sale',
+        'stock',
         'portal',
         'mail',
     ],
@@ -90,11 +91,13 @@ Vantaggi Business
         'data/ir_cron.xml',
         'views/portal_templates.xml',
         'views/sale_order_views.xml',
+        'views/product_pricelist_views.xml',
         'views/res_config_settings_views.xml',
     ],
     'assets': {
         'web.assets_frontend': [
             'NPAL_portal_sale_mod/static/src/js/portal_customer_select.js',
+            'NPAL_portal_sale_mod/static/src/js/agent_stock_info.js',
             'NPAL_portal_sale_mod/static/src/css/portal_sale.css',
         ],
     },
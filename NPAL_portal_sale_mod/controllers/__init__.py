@@ -2,3 +2,4 @@
 
 from . import portal
 from . import main
+from . import metrics
@@ -1,43 +1,103 @@
 # -*- coding: utf-8 -*-
 
+import calendar
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
 from odoo import http, fields, _
 from odoo.http import request
 from odoo.addons.website_sale.controllers.main import WebsiteSale
 from odoo.exceptions import UserError
 
+from ..models.product_pricelist import AGENT_PRICE_TABLE_CONTEXT_KEY
+from ..tools.agent_metrics import agent_metrics, instrument
+from ..tools.http_cache import is_not_modified, layout_version, make_etag, not_modified_response, set_cache_headers
+from ..tools.read_replica import replica_read
+from ..tools.single_flight import single_flight
+
+# Colonne delle righe del catalogo agente
+CATALOGUE_FIELDS = ['id', 'code', 'name', 'uom', 'price', 'stock']
+# Sovrapposizione tra versioni: copre le transazioni ancora aperte quando è stato emesso il token
+CATALOGUE_TOKEN_OVERLAP = timedelta(minutes=5)
+# Prodotti mostrati nella pagina di ordine rapido
+QUICK_ORDER_LIMIT = 50
+
 
 class WebsiteSaleAgent(WebsiteSale):
 
     def _get_mandatory_fields_billing(self):
         """Override per evitare che l'agente debba compilare i dati di fatturazione."""
-        if request.session.get('agent_selected_customer_id') and request.env.user.has_group('base.group_portal'):
+        agent_context = request.env.user._get_agent_context()
+        if agent_context.customer_id and agent_context.is_agent:
             return []
         return super()._get_mandatory_fields_billing()
 
+    def _use_agent_price_table(self):
+        """
+        Le richieste del portale agenti leggono i prezzi dalla tabella
+        precalcolata: la chiave di contesto vale per request.env e per il sito
+        (carrello e righe ordine).
+        """
+        if request.env.user._get_agent_context().is_agent:
+            request.update_context(**{AGENT_PRICE_TABLE_CONTEXT_KEY: True})
+            request.website = request.website.with_context(**{AGENT_PRICE_TABLE_CONTEXT_KEY: True})
+
+    def _prepare_agent_cart(self, customer, pricelist, force_create=True):
+        """
+        Carrello corrente intestato al cliente selezionato con il suo listino
+        (scritto solo se cambia), da chiamare prima di aggiungere righe: i
+        prezzi vengono calcolati una sola volta. Con force_create=False
+        restituisce un recordset vuoto se il carrello non esiste.
+        """
+        order = request.website.sale_get_order(force_create=force_create)
+        if order and (order.partner_id != customer or order.pricelist_id != pricelist):
+            order.sudo().write({
+                'partner_id': customer.id,
+                'partner_invoice_id': customer.id,
+                'partner_shipping_id': customer.id,
+                'pricelist_id': pricelist.id,
+            })
+        return order
+
+    def product(self, *args, **kwargs):
+        self._use_agent_price_table()
+        return super().product(*args, **kwargs)
+
+    def cart_update(self, *args, **kwargs):
+        self._use_agent_price_table()
+        return super().cart_update(*args, **kwargs)
+
+    def cart_update_json(self, *args, **kwargs):
+        self._use_agent_price_table()
+        return super().cart_update_json(*args, **kwargs)
+
+    @instrument('website_sale_agent.shop')
     def shop(self, page=0, category=None, search='', min_price=0.0, max_price=0.0, **post):
         """
         Override dello shop per applicare il listino del cliente selezionato.
         """
         # Se c'è un cliente selezionato, forza il suo listino
-        if request.session.get('agent_selected_customer_id'):
-            customer_id = request.session.get('agent_selected_customer_id')
-            customer = request.env['res.partner'].sudo().browse(customer_id)
-
-            if customer.exists() and customer.property_product_pricelist:
-                # Forza il listino del cliente nella sessione
-                request.session['website_sale_current_pl'] = customer.property_product_pricelist.id
-
-                # Aggiorna anche l'ordine corrente se esiste
-                order = request.website.sale_get_order()
-                if order:
-                    order.sudo().write({
-                        'partner_id': customer.id,
-                        'partner_invoice_id': customer.id,
-                        'partner_shipping_id': customer.id,
-                        'pricelist_id': customer.property_product_pricelist.id,
-                    })
-
-        return super().shop(page=page, category=category, search=search, min_price=min_price, max_price=max_price, **post)
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        customer = agent_context.customer
+        if customer and agent_context.pricelist:
+            # Forza il listino del cliente nella sessione
+            request.session['website_sale_current_pl'] = agent_context.pricelist.id
+
+            # Aggiorna anche l'ordine corrente se esiste
+            self._prepare_agent_cart(customer, agent_context.pricelist, force_create=False)
+
+        response = super().shop(page=page, category=category, search=search, min_price=min_price, max_price=max_price, **post)
+
+        # Badge disponibilità nella griglia: una query sulla tabella materializzata per la pagina
+        if agent_context.is_agent and getattr(response, 'qcontext', None) and response.qcontext.get('products'):
+            warehouses = request.env['stock.warehouse'].sudo().search([
+                ('company_id', '=', request.env.company.id)
+            ])
+            response.qcontext['agent_availability'] = request.env['agent.stock.availability'].sudo()._get_template_availability(
+                response.qcontext['products'], warehouses)
+        return response
 
     def _get_shop_payment_values(self, order, **kwargs):
         """
@@ -47,95 +107,82 @@ class WebsiteSaleAgent(WebsiteSale):
         values = super()._get_shop_payment_values(order, **kwargs)
 
         # Se c'è un cliente selezionato da un agente, aggiorna i valori
-        if request.session.get('agent_selected_customer_id'):
-            customer_id = request.session.get('agent_selected_customer_id')
-            customer = request.env['res.partner'].browse(customer_id)
-
-            if customer.exists():
-                values['partner'] = customer
+        customer = request.env.user._get_agent_context().customer
+        if customer:
+            values['partner'] = customer.with_env(request.env)
 
         return values
 
+    @instrument('website_sale_agent.cart')
     def cart(self, **post):
         """
         Override del carrello per gestire il partner del cliente selezionato.
         """
         # Se c'è un cliente selezionato, assicurati che l'ordine usi quel partner e listino
-        if request.session.get('agent_selected_customer_id'):
-            customer_id = request.session.get('agent_selected_customer_id')
-            customer = request.env['res.partner'].sudo().browse(customer_id)
-
-            if customer.exists():
-                order = request.website.sale_get_order()
-                if order:
-                    # Aggiorna il partner E il listino dell'ordine
-                    pricelist = customer.property_product_pricelist or request.website.get_current_pricelist()
-
-                    order.sudo().write({
-                        'partner_id': customer.id,
-                        'partner_invoice_id': customer.id,
-                        'partner_shipping_id': customer.id,
-                        'pricelist_id': pricelist.id,
-                    })
-
-                    # Ricalcola i prezzi delle righe ordine con il nuovo listino
-                    for line in order.order_line:
-                        line.sudo()._compute_price_unit()
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        customer = agent_context.customer
+        if customer:
+            # Aggiorna il partner E il listino dell'ordine
+            pricelist = agent_context.pricelist or request.website.get_current_pricelist()
+            order = self._prepare_agent_cart(customer, pricelist, force_create=False)
+            if order:
+                # Ricalcola i prezzi delle righe ordine con il nuovo listino
+                for line in order.order_line:
+                    line.sudo()._compute_price_unit()
 
         # Se l'agente clicca su "Procedi" nel carrello, reindirizza alla finalizzazione
-        if post.get('type') == 'click_checkout' and request.session.get('agent_selected_customer_id'):
+        if post.get('type') == 'click_checkout' and agent_context.customer_id:
             return request.redirect('/shop/agent/cart/finalize')
 
         return super().cart(**post)
 
     @http.route(['/shop/checkout'], type='http', auth="public", website=True, sitemap=False)
+    @instrument('website_sale_agent.checkout')
     def checkout(self, **post):
         """
         Override del checkout: se è un agente, reindirizza alla finalizzazione.
         """
         # Se c'è un cliente selezionato da un agente, reindirizza alla finalizzazione agente
-        if request.session.get('agent_selected_customer_id') and request.env.user.has_group('base.group_portal'):
+        agent_context = request.env.user._get_agent_context()
+        if agent_context.customer_id and agent_context.is_agent:
             return request.redirect('/shop/agent/cart/finalize')
 
         # Se c'è un cliente selezionato, assicurati che l'ordine usi quel partner
-        if request.session.get('agent_selected_customer_id'):
-            customer_id = request.session.get('agent_selected_customer_id')
-            customer = request.env['res.partner'].sudo().browse(customer_id)
-
-            if customer.exists():
-                order = request.website.sale_get_order()
-                if order and order.partner_id != customer:
-                    # Aggiorna il partner dell'ordine
-                    order.sudo().write({
-                        'partner_id': customer.id,
-                        'partner_invoice_id': customer.id,
-                        'partner_shipping_id': customer.id,
-                    })
-                    # Ricalcola i prezzi con il listino del cliente
-                    order.sudo()._onchange_partner_id()
+        customer = agent_context.customer
+        if customer:
+            order = request.website.sale_get_order()
+            if order and order.partner_id != customer:
+                # Aggiorna il partner dell'ordine
+                order.sudo().write({
+                    'partner_id': customer.id,
+                    'partner_invoice_id': customer.id,
+                    'partner_shipping_id': customer.id,
+                })
+                # Ricalcola i prezzi con il listino del cliente
+                order.sudo()._onchange_partner_id()
 
         return super().checkout(**post)
 
+    @instrument('website_sale_agent.address')
     def address(self, **kw):
         """
         Override per gestire gli indirizzi del cliente selezionato.
         """
         # Se c'è un cliente selezionato, usa i suoi indirizzi
-        if request.session.get('agent_selected_customer_id'):
-            customer_id = request.session.get('agent_selected_customer_id')
-            customer = request.env['res.partner'].sudo().browse(customer_id)
-
-            if customer.exists():
-                order = request.website.sale_get_order()
-                if order:
-                    order.sudo().write({
-                        'partner_id': customer.id,
-                        'partner_invoice_id': customer.id,
-                        'partner_shipping_id': customer.id,
-                    })
+        customer = request.env.user._get_agent_context().customer
+        if customer:
+            order = request.website.sale_get_order()
+            if order:
+                order.sudo().write({
+                    'partner_id': customer.id,
+                    'partner_invoice_id': customer.id,
+                    'partner_shipping_id': customer.id,
+                })
 
         return super().address(**kw)
 
+    @instrument('website_sale_agent.payment_transaction')
     def payment_transaction(self, *args, **kwargs):
         """
         Override per assicurarsi che la transazione sia associata al cliente corretto.
@@ -143,21 +190,57 @@ class WebsiteSaleAgent(WebsiteSale):
         result = super().payment_transaction(*args, **kwargs)
 
         # Dopo la conferma, pulisci il cliente selezionato dalla sessione
-        if 'agent_selected_customer_id' in request.session:
-            del request.session['agent_selected_customer_id']
+        request.env.user._get_agent_context().clear_customer()
 
         return result
 
+    def _get_agent_order_lines(self, order):
+        """
+        Legge in blocco i dati delle righe ordine mostrati nei riepiloghi agente.
+        Una read() sulle righe e una sui prodotti, indipendentemente dal numero
+        di righe, invece di letture riga per riga durante il rendering.
+        """
+        lines = order.sudo().order_line.read(
+            ['product_id', 'product_uom_qty', 'price_unit', 'price_subtotal'],
+            load=None,
+        )
+        product_ids = list({line['product_id'] for line in lines if line['product_id']})
+        product_names = {
+            product['id']: product['name']
+            for product in request.env['product.product'].sudo().browse(product_ids).read(['name'])
+        }
+
+        return [{
+            'product_name': product_names.get(line['product_id'], ''),
+            'product_uom_qty': line['product_uom_qty'],
+            'price_unit': line['price_unit'],
+            'price_subtotal': line['price_subtotal'],
+        } for line in lines]
+
+    def _get_shipping_addresses_domain(self, customer):
+        """Indirizzi di spedizione selezionabili: il cliente e i suoi indirizzi di consegna."""
+        return [
+            '|',
+            ('id', '=', customer.id),
+            '&',
+            ('parent_id', '=', customer.id),
+            ('type', '=', 'delivery')
+        ]
+
     @http.route(['/shop/agent/cart/finalize'], type='http', auth='user', website=True)
+    @instrument('website_sale_agent.agent_cart_finalize')
     def agent_cart_finalize(self, **post):
         """
         Pagina finale per l'agente: scelta tra preventivo o ordine.
         Questa pagina sostituisce il checkout standard per gli agenti.
         """
-        if not request.env.user.has_group('base.group_portal') or request.env.user._is_public():
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        if not agent_context.is_agent:
             return request.redirect('/shop/cart')
 
-        if not request.session.get('agent_selected_customer_id'):
+        customer = agent_context.customer
+        if not customer:
             return request.redirect('/my/orders/new')
 
         order = request.website.sale_get_order()
@@ -165,9 +248,6 @@ class WebsiteSaleAgent(WebsiteSale):
             return request.redirect('/shop')
 
         # Assicurati che il partner sia quello del cliente selezionato
-        customer_id = request.session.get('agent_selected_customer_id')
-        customer = request.env['res.partner'].sudo().browse(customer_id)
-
         if order.partner_id != customer:
             order.sudo().write({
                 'partner_id': customer.id,
@@ -176,67 +256,129 @@ class WebsiteSaleAgent(WebsiteSale):
             })
             order.sudo()._onchange_partner_id()
 
-        # Recupera magazzini
-        warehouses = request.env['stock.warehouse'].sudo().search([
-            ('company_id', '=', request.env.company.id)
-        ])
-
-        # Recupera indirizzi di spedizione del cliente
-        shipping_addresses = request.env['res.partner'].sudo().search([
-            '|',
-            ('id', '=', customer.id),
-            '&',
-            ('parent_id', '=', customer.id),
-            ('type', '=', 'delivery')
-        ])
-
-        # Verifica se sale_voucher è installato
-        voucher_module_installed = request.env['ir.module.module'].sudo().search([
-            ('name', '=', 'sale_voucher'),
-            ('state', '=', 'installed')
-        ], limit=1)
+        submission_token = order.sudo()._get_agent_submission_token()
+        warehouse_domain = [('company_id', '=', request.env.company.id)]
+        shipping_domain = self._get_shipping_addresses_domain(customer)
+        # Il modello sale.voucher è nel registry solo se sale_voucher è installato
+        voucher_module_installed = 'sale.voucher' in request.env
+        # Indirizzo appena aggiunto o riusato da /my/orders/add_address: preselezionato nel form
+        try:
+            selected_shipping_address_id = int(post.get('shipping_address_id') or 0)
+        except ValueError:
+            selected_shipping_address_id = 0
+
+        # Indirizzi e magazzini dalla replica di lettura (se configurata); il carrello dal primario
+        shipping_stamp, warehouse_stamp = replica_read(request.env, lambda env: (
+            env['res.partner'].sudo()._read_group(shipping_domain, [], ['__count', 'write_date:max']),
+            env['stock.warehouse'].sudo()._read_group(warehouse_domain, [], ['__count', 'write_date:max']),
+        ))
+
+        # Pagina invariata se non cambiano carrello, indirizzi, magazzini e layout
+        etag = make_etag(
+            'agent_cart_finalize',
+            order.id,
+            order.write_date,
+            request.env['sale.order.line'].sudo()._read_group(
+                [('order_id', '=', order.id)], [], ['__count', 'write_date:max']),
+            shipping_stamp,
+            warehouse_stamp,
+            voucher_module_installed,
+            selected_shipping_address_id,
+            layout_version(),
+        )
+        if is_not_modified(etag):
+            return not_modified_response(etag)
+
+        # Recupera magazzini e indirizzi di spedizione del cliente
+        warehouse_ids, shipping_address_ids = replica_read(request.env, lambda env: (
+            env['stock.warehouse'].sudo().search(warehouse_domain).ids,
+            env['res.partner'].sudo().search(shipping_domain).ids,
+        ))
+        warehouses = request.env['stock.warehouse'].sudo().browse(warehouse_ids)
+        shipping_addresses = request.env['res.partner'].sudo().browse(shipping_address_ids)
+
+        order_lines = self._get_agent_order_lines(order)
+        agent_metrics.set_records(len(order_lines))
 
         values = {
             'order': order,
+            'order_lines': order_lines,
             'customer': customer,
-            'agent': request.env.user.partner_id,
+            'agent': agent_context.partner,
             'warehouses': warehouses,
             'shipping_addresses': shipping_addresses,
-            'voucher_module_installed': bool(voucher_module_installed),
+            'selected_shipping_address_id': selected_shipping_address_id,
+            'submission_token': submission_token,
+            'voucher_module_installed': voucher_module_installed,
         }
 
-        return request.render('NPAL_portal_sale_mod.agent_cart_finalize', values)
+        response = request.render('NPAL_portal_sale_mod.agent_cart_finalize', values)
+        return set_cache_headers(response, etag)
+
+    def _start_agent_submission(self, post, result_url):
+        """
+        Controlli di idempotenza per gli invii dalla pagina di finalizzazione.
+        Restituisce (ordine, risposta): se la risposta è valorizzata va
+        restituita così com'è, senza scritture sull'ordine:
+        * invio già eseguito con lo stesso token: pagina del primo esito
+        * carrello vuoto: shop
+        * token mancante o di un altro carrello: nuova finalizzazione
+        * stesso carrello già in elaborazione (riga bloccata): pagina di esito
+        """
+        token = post.get('submission_token')
+        if token:
+            submitted = request.env['sale.order'].sudo().search([
+                ('agent_submission_token', '=', token),
+                ('agent_submission_result', '!=', False),
+            ], limit=1)
+            if submitted:
+                request.session['sale_last_order_id'] = submitted.id
+                return submitted, request.redirect(submitted.agent_submission_result)
+
+        order = request.website.sale_get_order()
+        if not order:
+            return order, request.redirect('/shop')
+
+        if not token or token != order.agent_submission_token:
+            return order, request.redirect('/shop/agent/cart/finalize')
+
+        if not order.sudo()._lock_agent_submission():
+            request.session['sale_last_order_id'] = order.id
+            return order, request.redirect(result_url)
+
+        return order, None
 
     @http.route(['/shop/agent/create_quotation'], type='http', auth='user', website=True, methods=['POST'])
+    @instrument('website_sale_agent.agent_create_quotation')
     def agent_create_quotation(self, **post):
         """
         Crea un preventivo (quotation) senza confermare l'ordine.
         """
-        if not request.env.user.has_group('base.group_portal') or request.env.user._is_public():
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return request.redirect('/shop/cart')
 
-        order = request.website.sale_get_order()
-        if not order:
-            return request.redirect('/shop')
+        result_url = '/shop/agent/confirmation?quotation=1'
+        order, response = self._start_agent_submission(post, result_url)
+        if response:
+            return response
 
         # Assicurati che il partner sia corretto
-        if request.session.get('agent_selected_customer_id'):
-            customer_id = request.session.get('agent_selected_customer_id')
-            customer = request.env['res.partner'].sudo().browse(customer_id)
-
-            if order.partner_id != customer:
-                order.sudo().write({
-                    'partner_id': customer.id,
-                    'partner_invoice_id': customer.id,
-                    'partner_shipping_id': customer.id,
-                })
+        customer = agent_context.customer
+        if customer and order.partner_id != customer:
+            order.sudo().write({
+                'partner_id': customer.id,
+                'partner_invoice_id': customer.id,
+                'partner_shipping_id': customer.id,
+            })
 
         # Salva i campi obbligatori
         order_vals = {
             'state': 'draft',
             'is_agent_order': True,
-            'created_by_agent_id': request.env.user.id,
+            'created_by_agent_id': agent_context.partner.id,
             'agent_order_status': 'quotation',  # Imposta stato a Preventivo
+            'agent_submission_result': result_url,
         }
 
         if post.get('order_note'):
@@ -264,41 +406,41 @@ class WebsiteSaleAgent(WebsiteSale):
         # Pulisci la sessione
         request.session['sale_last_order_id'] = order.id
         request.website.sale_reset()
-        if 'agent_selected_customer_id' in request.session:
-            del request.session['agent_selected_customer_id']
+        agent_context.clear_customer()
 
-        return request.redirect('/shop/agent/confirmation?quotation=1')
+        return request.redirect(result_url)
 
     @http.route(['/shop/agent/create_order'], type='http', auth='user', website=True, methods=['POST'])
+    @instrument('website_sale_agent.agent_create_order')
     def agent_create_order(self, **post):
         """
         Crea un ordine in bozza (da confermare dal backoffice).
         """
-        if not request.env.user.has_group('base.group_portal') or request.env.user._is_public():
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return request.redirect('/shop/cart')
 
-        order = request.website.sale_get_order()
-        if not order:
-            return request.redirect('/shop')
+        result_url = '/shop/agent/confirmation?order=1'
+        order, response = self._start_agent_submission(post, result_url)
+        if response:
+            return response
 
         # Assicurati che il partner sia corretto
-        if request.session.get('agent_selected_customer_id'):
-            customer_id = request.session.get('agent_selected_customer_id')
-            customer = request.env['res.partner'].sudo().browse(customer_id)
-
-            if order.partner_id != customer:
-                order.sudo().write({
-                    'partner_id': customer.id,
-                    'partner_invoice_id': customer.id,
-                    'partner_shipping_id': customer.id,
-                })
+        customer = agent_context.customer
+        if customer and order.partner_id != customer:
+            order.sudo().write({
+                'partner_id': customer.id,
+                'partner_invoice_id': customer.id,
+                'partner_shipping_id': customer.id,
+            })
 
         # Salva i campi obbligatori
         order_vals = {
             'state': 'sent',
             'is_agent_order': True,
-            'created_by_agent_id': request.env.user.id,
+            'created_by_agent_id': agent_context.partner.id,
             'agent_order_status': 'agent_incoming',  # Imposta stato a Ordine in entrata da agente
+            'agent_submission_result': result_url,
         }
 
         if post.get('order_note'):
@@ -326,34 +468,35 @@ class WebsiteSaleAgent(WebsiteSale):
         # Pulisci la sessione
         request.session['sale_last_order_id'] = order.id
         request.website.sale_reset()
-        if 'agent_selected_customer_id' in request.session:
-            del request.session['agent_selected_customer_id']
+        agent_context.clear_customer()
 
-        return request.redirect('/shop/agent/confirmation?order=1')
+        return request.redirect(result_url)
 
     @http.route(['/shop/agent/create_voucher'], type='http', auth='user', website=True, methods=['POST'])
+    @instrument('website_sale_agent.agent_create_voucher')
     def agent_create_voucher(self, **post):
         """
         Crea un buono interno utilizzando il modulo sale_voucher.
         """
-        if not request.env.user.has_group('base.group_portal') or request.env.user._is_public():
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return request.redirect('/shop/cart')
 
         # Verifica che il modulo sale_voucher sia installato
         if 'sale.voucher' not in request.env:
             return request.redirect('/shop/cart')
 
-        order = request.website.sale_get_order()
-        if not order:
-            return request.redirect('/shop')
+        # Prima i controlli di idempotenza: il primo invio rimuove il cliente selezionato
+        result_url = '/shop/agent/confirmation?voucher=1'
+        order, response = self._start_agent_submission(post, result_url)
+        if response:
+            return response
 
         # Recupera il cliente
-        customer_id = request.session.get('agent_selected_customer_id')
-        if not customer_id:
+        customer = agent_context.customer
+        if not customer:
             return request.redirect('/my/orders/new')
 
-        customer = request.env['res.partner'].sudo().browse(int(customer_id))
-
         # Crea il buono
         voucher_vals = {
             'recipient_id': customer.id,
@@ -393,15 +536,54 @@ class WebsiteSaleAgent(WebsiteSale):
         if post.get('order_note'):
             voucher.sudo().write({'note': post.get('order_note')})
 
+        order.sudo().write({'agent_submission_result': result_url})
+
         # Pulisci la sessione
         request.session['sale_voucher_id'] = voucher.id
         request.website.sale_reset()
-        if 'agent_selected_customer_id' in request.session:
-            del request.session['agent_selected_customer_id']
+        agent_context.clear_customer()
+
+        return request.redirect(result_url)
+
+    def _get_product_stock_values(self, product_id, warehouse_id):
+        """
+        Disponibilità di un prodotto in un magazzino letta dalla tabella
+        materializzata (ricerca per chiave) e timbro di versione per l'ETag.
+        Restituisce (valori, versione); versione è None in caso di errore.
+        Le richieste concorrenti per lo stesso prodotto e magazzino condividono
+        un unico calcolo, eseguito sulla replica di lettura se configurata.
+        """
+        key = (request.env.cr.dbname, request.env.lang, int(product_id), int(warehouse_id))
+        return single_flight.do(
+            'product_stock', key,
+            lambda: self._compute_product_stock_values(product_id, warehouse_id),
+        )
+
+    def _compute_product_stock_values(self, product_id, warehouse_id):
+        return replica_read(request.env, lambda env: self._read_product_stock_values(env, product_id, warehouse_id))
+
+    def _read_product_stock_values(self, env, product_id, warehouse_id):
+        product = env['product.product'].sudo().browse(int(product_id))
+        warehouse = env['stock.warehouse'].sudo().browse(int(warehouse_id))
 
-        return request.redirect('/shop/agent/confirmation?voucher=1')
+        if not product.exists() or not warehouse.exists():
+            return {'error': 'Product or warehouse not found'}, None
+
+        # Ottieni la quantità disponibile nel magazzino specifico
+        availability = env['agent.stock.availability'].sudo()._lookup(product, warehouse)
+        quantity, reserved_quantity, change_date = availability.get((product.id, warehouse.id), (0.0, 0.0, None))
+
+        values = {
+            'qty_available': quantity - reserved_quantity,
+            'uom_name': product.uom_id.name,
+            'product_name': product.display_name,
+            'warehouse_name': warehouse.name,
+        }
+        version = (product.id, warehouse.id, change_date, product.write_date, warehouse.write_date)
+        return values, version
 
     @http.route(['/shop/product/stock'], type='json', auth='user', website=True)
+    @instrument('website_sale_agent.get_product_stock')
     def get_product_stock(self, product_id=None, warehouse_id=None):
         """
         Restituisce la quantità disponibile di un prodotto in un magazzino specifico.
@@ -410,31 +592,375 @@ class WebsiteSaleAgent(WebsiteSale):
             return {'error': 'Missing parameters'}
 
         try:
-            product = request.env['product.product'].sudo().browse(int(product_id))
-            warehouse = request.env['stock.warehouse'].sudo().browse(int(warehouse_id))
+            return self._get_product_stock_values(product_id, warehouse_id)[0]
+        except Exception as e:
+            return {'error': str(e)}
 
-            if not product.exists() or not warehouse.exists():
-                return {'error': 'Product or warehouse not found'}
+    @http.route(['/shop/product/stock/<int:product_id>/<int:warehouse_id>'], type='http', auth='user',
+                website=True, methods=['GET'], sitemap=False)
+    @instrument('website_sale_agent.get_product_stock_http')
+    def get_product_stock_http(self, product_id, warehouse_id, **kw):
+        """
+        Variante GET di /shop/product/stock con supporto a ETag/If-None-Match:
+        risponde 304 se la disponibilità del prodotto nel magazzino non è cambiata.
+        """
+        try:
+            values, version = self._get_product_stock_values(product_id, warehouse_id)
+        except Exception as e:
+            values, version = {'error': str(e)}, None
 
-            # Ottieni la quantità disponibile nel magazzino specifico
-            stock_quant = request.env['stock.quant'].sudo().search([
-                ('product_id', '=', product.id),
-                ('location_id', 'child_of', warehouse.lot_stock_id.id)
-            ])
+        if version is None:
+            return request.make_json_response(values)
+
+        # Nome prodotto e UdM sono tradotti: la lingua fa parte della versione
+        etag = make_etag('product_stock', request.env.lang, version)
+        if is_not_modified(etag):
+            return not_modified_response(etag)
+        return set_cache_headers(request.make_json_response(values), etag)
+
+    @http.route(['/shop/agent/warehouses'], type='http', auth='user', website=True, methods=['GET'], sitemap=False)
+    @instrument('website_sale_agent.agent_warehouses')
+    def agent_warehouses(self, **kw):
+        """
+        Magazzini dell'azienda corrente per il selettore di disponibilità
+        della scheda prodotto, caricati dal widget solo quando il riquadro
+        entra nella pagina visibile. Con ETag: 304 se i magazzini non cambiano.
+        """
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
+            return request.make_json_response({'error': 'Forbidden'}, status=403)
+
+        warehouse_domain = [('company_id', '=', request.env.company.id)]
+
+        def read_warehouses(env):
+            Warehouse = env['stock.warehouse'].sudo()
+            etag = make_etag('agent_warehouses', Warehouse._read_group(warehouse_domain, [], ['__count', 'write_date:max']))
+            if is_not_modified(etag):
+                return etag, None
+            return etag, [[warehouse.id, warehouse.name] for warehouse in Warehouse.search(warehouse_domain, order='id')]
+
+        etag, warehouses = replica_read(request.env, read_warehouses)
+        if warehouses is None:
+            return not_modified_response(etag)
+
+        agent_metrics.set_records(len(warehouses))
+        return set_cache_headers(request.make_json_response({'warehouses': warehouses}), etag)
+
+    def _get_warehouse_availability(self, products, warehouses):
+        """
+        Disponibilità (quantità - riservato) per prodotto e magazzino, letta
+        dalla tabella materializzata con una sola query (sulla replica di
+        lettura, se configurata). Restituisce {(product_id, warehouse_id): quantità}.
+        """
+        availability = replica_read(
+            request.env, lambda env: env['agent.stock.availability'].sudo()._lookup(products, warehouses))
+        return {key: quantity - reserved_quantity for key, (quantity, reserved_quantity, _date) in availability.items()}
+
+    def _get_catalogue_products_domain(self):
+        """Prodotti inclusi nel catalogo agente."""
+        return [('sale_ok', '=', True), ('website_published', '=', True)]
+
+    def _make_catalogue_version(self, pricelist, now):
+        timestamp = calendar.timegm((now - CATALOGUE_TOKEN_OVERLAP).timetuple())
+        return '%s.%s' % (pricelist.id, timestamp)
+
+    def _parse_catalogue_version(self, version, pricelist):
+        """Data di riferimento del token, o False se non valido o di un altro listino."""
+        try:
+            pricelist_id, timestamp = version.split('.')
+            if int(pricelist_id) != pricelist.id:
+                return False
+            return datetime.fromtimestamp(int(timestamp), timezone.utc).replace(tzinfo=None)
+        except (AttributeError, ValueError, OverflowError):
+            return False
+
+    def _get_catalogue_changed_products(self, pricelist, warehouses, since):
+        """
+        Prodotti (anche archiviati) modificati dopo `since` in anagrafica,
+        prezzo o giacenza. Il ritardo massimo della replica di lettura resta
+        coperto dalla sovrapposizione del token (CATALOGUE_TOKEN_OVERLAP).
+        """
+
+        def read_changed_ids(env):
+            changed_ids = set(env['product.product'].sudo().with_context(active_test=False).search([
+                '|', ('write_date', '>', since), ('product_tmpl_id.write_date', '>', since),
+            ]).ids)
+            changed_ids.update(env['agent.pricelist.price'].sudo()._get_changed_product_ids(pricelist, since))
+            changed_ids.update(env['agent.stock.availability'].sudo()._get_changed_product_ids(warehouses, since))
+            return changed_ids
+
+        changed_ids = replica_read(request.env, read_changed_ids)
+        return request.env['product.product'].sudo().with_context(active_test=False).browse(changed_ids)
+
+    @http.route(['/shop/agent/catalogue'], type='http', auth='user', website=True, methods=['GET'], sitemap=False)
+    @instrument('website_sale_agent.agent_catalogue')
+    def agent_catalogue(self, version=None, **kw):
+        """
+        Catalogo compatto del cliente selezionato per l'uso offline da tablet:
+        prodotti con codice, nome, UdM, prezzo del listino cliente e
+        disponibilità per magazzino. Con il parametro `version` (token della
+        risposta precedente) restituisce solo le righe cambiate e gli ID dei
+        prodotti non più disponibili.
+        """
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        if not agent_context.is_agent:
+            return request.make_json_response({'error': 'Forbidden'}, status=403)
 
-            qty_available = sum(stock_quant.mapped('quantity')) - sum(stock_quant.mapped('reserved_quantity'))
+        customer = agent_context.customer
+        if not customer:
+            return request.make_json_response({'error': 'No customer selected'}, status=400)
 
-            return {
-                'qty_available': qty_available,
-                'uom_name': product.uom_id.name,
-                'product_name': product.display_name,
-                'warehouse_name': warehouse.name,
+        pricelist = (agent_context.pricelist or request.website.pricelist_id).sudo()
+        warehouses = request.env['stock.warehouse'].sudo().search([
+            ('company_id', '=', request.env.company.id)
+        ], order='id')
+        now = fields.Datetime.now()
+
+        # Il delta richiede la tabella prezzi allineata per rilevare le variazioni di prezzo
+        since = version and self._parse_catalogue_version(version, pricelist)
+        if since and (not pricelist.agent_price_table or pricelist.agent_price_table_dirty):
+            since = False
+
+        domain = self._get_catalogue_products_domain()
+        removed_ids = []
+        if since:
+            changed = self._get_catalogue_changed_products(pricelist, warehouses, since)
+            products = changed.filtered_domain(domain + [('active', '=', True)])
+            removed_ids = (changed - products).ids
+        else:
+            product_ids = replica_read(
+                request.env, lambda env: env['product.product'].sudo().search(domain, order='id').ids)
+            products = request.env['product.product'].sudo().browse(product_ids)
+
+        prices = pricelist._get_products_price(products, 1.0)
+        availability = self._get_warehouse_availability(products, warehouses)
+        agent_metrics.set_records(len(products))
+
+        data = {
+            'version': self._make_catalogue_version(pricelist, now),
+            'full': not since,
+            'customer_id': customer.id,
+            'pricelist_id': pricelist.id,
+            'currency': pricelist.currency_id.name,
+            'warehouses': [[warehouse.id, warehouse.name] for warehouse in warehouses],
+            'fields': CATALOGUE_FIELDS,
+            'products': [[
+                product.id,
+                product.default_code or '',
+                product.name,
+                product.uom_id.name,
+                prices.get(product.id, 0.0),
+                [availability.get((product.id, warehouse.id), 0.0) for warehouse in warehouses],
+            ] for product in products],
+            'removed': removed_ids,
+        }
+
+        body = json.dumps(data, separators=(',', ':')).encode()
+        headers = [
+            ('Content-Type', 'application/json; charset=utf-8'),
+            ('Cache-Control', 'private, no-cache'),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if 'gzip' in request.httprequest.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        return request.make_response(body, headers)
+
+    @http.route(['/shop/agent/cart/bulk'], type='json', auth='user', website=True)
+    @instrument('website_sale_agent.agent_cart_bulk')
+    def agent_cart_bulk(self, lines=None, **kw):
+        """
+        Imposta in un'unica chiamata le righe del carrello costruito offline
+        dal catalogo: `lines` è una lista di {'product_id', 'qty'} con le
+        quantità finali. Dopo l'invio il client prosegue con la finalizzazione.
+        """
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        if not agent_context.is_agent:
+            return {'error': 'Forbidden'}
+
+        customer = agent_context.customer
+        if not customer:
+            return {'error': 'No customer selected'}
+
+        pricelist = agent_context.pricelist or request.website.pricelist_id
+        order = self._prepare_agent_cart(customer, pricelist)
+
+        for line in lines or []:
+            order._cart_update(product_id=int(line['product_id']), set_qty=float(line.get('qty') or 0))
+        agent_metrics.set_records(len(lines or []))
+
+        return {
+            'order_id': order.id,
+            'line_count': len(order.order_line),
+            'amount_total': order.amount_total,
+            'redirect': '/shop/agent/cart/finalize',
+        }
+
+    @http.route(['/my/agent/orders/<int:order_id>/reorder'], type='http', auth='user', website=True, methods=['POST'])
+    @instrument('website_sale_agent.agent_reorder')
+    def agent_reorder(self, order_id, **post):
+        """
+        Riordino in un clic: seleziona il cliente dell'ordine scelto e ne
+        copia le righe nel carrello corrente con un'unica create, prezzate
+        una sola volta con il listino attuale del cliente. I prodotti non più
+        vendibili vengono saltati e segnalati; quelli senza disponibilità nei
+        magazzini vengono copiati con un avviso sulla riga.
+        """
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        if not agent_context.is_agent:
+            return request.redirect('/my')
+
+        source = request.env['sale.order'].sudo().browse(order_id).exists()
+        if not source:
+            return request.redirect('/my/agent/orders')
+        source._check_agent_access()
+
+        # Il cliente dell'ordine deve essere ancora associato all'agente
+        customer = agent_context.partner._get_agent_customer(source.partner_id.id)
+        if not customer:
+            return request.redirect('/my/agent/orders')
+
+        # Cambio cliente: il carrello di un altro cliente resta parcheggiato e
+        # le righe vanno nel carrello del cliente dell'ordine (ripreso se parcheggiato)
+        agent_context.select_customer(customer.id)
+        pricelist = agent_context.pricelist or request.website.pricelist_id
+
+        # Il listino va impostato prima della creazione delle righe: un solo calcolo dei prezzi
+        order = self._prepare_agent_cart(customer, pricelist)
+
+        source_lines = request.env['sale.order.line'].sudo().search_fetch(
+            [('order_id', '=', source.id), ('display_type', '=', False), ('product_id', '!=', False)],
+            ['product_id', 'product_uom_qty', 'product_uom'],
+            order='sequence, id',
+        )
+        warehouses = request.env['stock.warehouse'].sudo().search([
+            ('company_id', '=', request.env.company.id)
+        ])
+        availability = request.env['agent.stock.availability'].sudo()._get_sale_availability(
+            source_lines.product_id.ids, warehouses)
+
+        vals_list = []
+        skipped = request.env['product.product']
+        for line in source_lines:
+            saleable, quantity = availability.get(line.product_id.id, (False, 0.0))
+            if not saleable:
+                skipped |= line.product_id
+                continue
+            vals = {
+                'order_id': order.id,
+                'product_id': line.product_id.id,
+                'product_uom_qty': line.product_uom_qty,
+                'product_uom': line.product_uom.id,
             }
+            if quantity <= 0:
+                vals['shop_warning'] = _("Prodotto non disponibile a magazzino")
+            vals_list.append(vals)
 
-        except Exception as e:
-            return {'error': str(e)}
+        request.env['sale.order.line'].sudo().create(vals_list)
+        agent_metrics.set_records(len(vals_list))
+
+        if skipped:
+            order.sudo().shop_warning = _(
+                "Prodotti non più disponibili alla vendita, non copiati da %(order)s: %(products)s",
+                order=source.name,
+                products=', '.join(skipped.mapped('display_name')),
+            )
+
+        return request.redirect('/shop/cart')
+
+    @http.route(['/shop/agent/quick'], type='http', auth='user', website=True, sitemap=False)
+    @instrument('website_sale_agent.agent_quick_order')
+    def agent_quick_order(self, **kw):
+        """
+        Ordine rapido: i prodotti più ordinati dal cliente selezionato con
+        prezzo del suo listino e disponibilità, letti dalla tabella dei
+        prodotti frequenti senza scorrere lo storico ordini. Senza storico
+        l'agente prosegue nello shop.
+        """
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        if not agent_context.is_agent:
+            return request.redirect('/shop')
+
+        customer = agent_context.customer
+        if not customer:
+            return request.redirect('/my/orders/new')
+
+        pricelist = (agent_context.pricelist or request.website.pricelist_id).sudo()
+        warehouses = request.env['stock.warehouse'].sudo().search([
+            ('company_id', '=', request.env.company.id)
+        ])
+        rows = request.env['agent.customer.product'].sudo()._get_quick_order_rows(
+            customer, pricelist, warehouses, QUICK_ORDER_LIMIT)
+        if not rows:
+            return request.redirect('/shop')
+
+        # Prezzi non presenti, non allineati o coperti da regole a date: calcolo dalle regole
+        Product = request.env['product.product'].sudo()
+        dated_ids = pricelist._get_agent_price_table_dated_product_ids()
+        use_price_table = pricelist.agent_price_table and not pricelist.agent_price_table_dirty and dated_ids is not None
+        missing = Product.browse([
+            row['product_id'] for row in rows
+            if row['price'] is None or not use_price_table or row['product_id'] in dated_ids
+        ])
+        if missing:
+            prices = pricelist._get_products_price(missing, 1.0)
+            for row in rows:
+                if row['product_id'] in prices:
+                    row['price'] = prices[row['product_id']]
+
+        products = Product.browse([row['product_id'] for row in rows])
+        for row, product in zip(rows, products):
+            row['product'] = product
+        agent_metrics.set_records(len(rows))
+
+        values = {
+            'customer': customer,
+            'rows': rows,
+            'currency': pricelist.currency_id,
+        }
+        return request.render('NPAL_portal_sale_mod.agent_quick_order', values)
+
+    @http.route(['/shop/agent/quick/add'], type='http', auth='user', website=True, methods=['POST'])
+    @instrument('website_sale_agent.agent_quick_order_add')
+    def agent_quick_order_add(self, **post):
+        """Aggiunge al carrello i prodotti della pagina di ordine rapido con quantità (qty_<product_id>) positiva."""
+        agent_context = request.env.user._get_agent_context()
+        self._use_agent_price_table()
+        if not agent_context.is_agent:
+            return request.redirect('/shop')
+
+        customer = agent_context.customer
+        if not customer:
+            return request.redirect('/my/orders/new')
+
+        quantities = {}
+        for key, value in post.items():
+            if not key.startswith('qty_'):
+                continue
+            try:
+                product_id, qty = int(key[4:]), float(value or 0)
+            except ValueError:
+                continue
+            if qty > 0:
+                quantities[product_id] = qty
+        if not quantities:
+            return request.redirect('/shop/agent/quick')
+
+        pricelist = agent_context.pricelist or request.website.pricelist_id
+        order = self._prepare_agent_cart(customer, pricelist)
+
+        for product_id, qty in quantities.items():
+            order._cart_update(product_id=product_id, add_qty=qty)
+        agent_metrics.set_records(len(quantities))
+
+        return request.redirect('/shop/cart')
 
     @http.route(['/shop/agent/confirmation'], type='http', auth='user', website=True)
+    @instrument('website_sale_agent.agent_order_confirmation')
     def agent_order_confirmation(self, **post):
         """
         Pagina di conferma dopo la creazione dell'ordine/preventivo/buono.
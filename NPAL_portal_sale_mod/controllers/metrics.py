@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from odoo import http, _
+from odoo.http import request
+from odoo.exceptions import AccessError
+
+from ..tools.agent_metrics import agent_metrics
+from ..tools.read_replica import replica_summary, reset_replica_summary
+from ..tools.single_flight import single_flight
+
+
+class AgentMetricsController(http.Controller):
+
+    @http.route(['/npal/agent/metrics'], type='json', auth='user')
+    def agent_metrics_summary(self, name=None, reset=False, **kw):
+        """
+        Restituisce i percentili di query, tempo SQL/Python e record per ogni
+        route e metodo strumentato del portale agenti (solo amministratori).
+        Le voci `single_flight.<gruppo>` riportano chiamate, calcoli eseguiti,
+        risultati condivisi e hit rate della coalescenza delle richieste;
+        la voce `read_replica` le letture servite dalla replica e le ricadute
+        sul primario.
+        I dati sono per processo: con più worker ogni risposta copre il worker
+        che ha servito la richiesta.
+        """
+        if not request.env.user.has_group('base.group_system'):
+            raise AccessError(_("Solo gli amministratori possono consultare le metriche del portale agenti."))
+
+        summary = agent_metrics.summary(name)
+        for group, stats in single_flight.summary().items():
+            if name is None or name == 'single_flight.%s' % group:
+                summary['single_flight.%s' % group] = stats
+        if name is None or name == 'read_replica':
+            summary['read_replica'] = replica_summary()
+        if reset:
+            agent_metrics.reset()
+            single_flight.reset()
+            reset_replica_summary()
+        return summary
@@ -1,44 +1,282 @@
 # -*- coding: utf-8 -*-
 
-from odoo import http, _
-from odoo.http import request
-from odoo.addons.portal.controllers.portal import CustomerPortal
+import csv
+import io
+from datetime import timedelta
+
+from odoo import api, fields, http, _
+from odoo.http import content_disposition, request
+from odoo.modules.registry import Registry
+from odoo.addons.portal.controllers.portal import CustomerPortal, pager as portal_pager
 from odoo.exceptions import AccessError, MissingError
 from odoo.tools import groupby as groupbyelem
 from operator import itemgetter
 
+from ..tools.agent_metrics import agent_metrics, instrument
+from ..tools.http_cache import is_not_modified, layout_version, make_etag, not_modified_response, set_cache_headers
+from ..tools.read_replica import pin_primary
+
+# Ordini letti per blocco durante l'export CSV
+AGENT_EXPORT_BATCH_SIZE = 500
+AGENT_EXPORT_ORDER_FIELDS = ['name', 'date_order', 'partner_id', 'agent_order_status', 'state',
+                             'commitment_date', 'amount_untaxed', 'amount_total', 'currency_id']
+AGENT_EXPORT_LINE_FIELDS = ['order_id', 'product_id', 'name', 'product_uom_qty', 'product_uom',
+                            'price_unit', 'discount', 'price_subtotal']
+# Caratteri iniziali che Excel interpreta come formula
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_text(value):
+    """Testo per il CSV: i valori che inizierebbero una formula sono preceduti da un apice."""
+    value = value or ''
+    return "'" + value if value.startswith(CSV_FORMULA_PREFIXES) else value
+
 
 class CustomerPortalAgent(CustomerPortal):
 
     @http.route(['/my/customers'], type='http', auth='user', website=True)
+    @instrument('customer_portal_agent.portal_my_customers')
     def portal_my_customers(self, **kw):
         """
         Pagina che mostra i clienti associati all'agente.
         """
-        if request.env.user._is_public() or not request.env.user.has_group('base.group_portal'):
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return request.redirect('/my')
 
-        partner = request.env.user.partner_id
-        customers = partner.get_agent_customers()
+        # Pagina invariata se non cambiano i clienti dell'agente né il layout
+        etag = make_etag('my_customers', agent_context.partner._get_agent_customers_version(), layout_version())
+        if is_not_modified(etag):
+            return not_modified_response(etag)
+
+        customers = agent_context.partner.get_agent_customers()
+        agent_metrics.set_records(len(customers))
 
         values = {
             'customers': customers,
             'page_name': 'customers',
         }
 
-        return request.render('NPAL_portal_sale_mod.portal_my_customers', values)
+        response = request.render('NPAL_portal_sale_mod.portal_my_customers', values)
+        return set_cache_headers(response, etag)
+
+    def _get_agent_orders_searchbar_sortings(self):
+        return {
+            'date': {'label': _('Data ordine'), 'order': 'date_order desc, id desc'},
+            'name': {'label': _('Riferimento'), 'order': 'name desc, id desc'},
+            'amount': {'label': _('Importo'), 'order': 'amount_total desc, id desc'},
+            'status': {'label': _('Stato operativo'), 'order': 'agent_order_status, date_order desc, id desc'},
+        }
+
+    def _get_agent_order_customer(self, agent_context, customer_id):
+        """Cliente dell'agente usato come filtro, o recordset vuoto se non valido."""
+        return agent_context.partner._get_agent_customer(customer_id)
+
+    @http.route(['/my/agent/orders', '/my/agent/orders/page/<int:page>'], type='http', auth='user', website=True)
+    @instrument('customer_portal_agent.portal_my_agent_orders')
+    def portal_my_agent_orders(self, page=1, sortby='date', status=None, customer_id=None, **kw):
+        """
+        Ordini creati dall'agente, paginati lato server, con ordinamento e
+        filtri per stato operativo e cliente. I conteggi per stato (facet)
+        arrivano da un unico raggruppamento e danno anche il totale del pager.
+        """
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
+            return request.redirect('/my')
+
+        SaleOrder = request.env['sale.order'].sudo()
+        searchbar_sortings = self._get_agent_orders_searchbar_sortings()
+        if sortby not in searchbar_sortings:
+            sortby = 'date'
+
+        domain = [('created_by_agent_id', '=', agent_context.partner.id)]
+        customer = self._get_agent_order_customer(agent_context, customer_id)
+        if customer:
+            domain.append(('partner_id', '=', customer.id))
+
+        # Facet per stato operativo: una sola query sull'indice agente/stato
+        status_counts = dict(SaleOrder._read_group(domain, ['agent_order_status'], ['__count']))
+        status_labels = dict(SaleOrder._fields['agent_order_status'].selection)
+        if status not in status_labels:
+            status = None
+        if status:
+            domain.append(('agent_order_status', '=', status))
+            order_count = status_counts.get(status, 0)
+        else:
+            order_count = sum(status_counts.values())
+
+        url_args = {'sortby': sortby}
+        if status:
+            url_args['status'] = status
+        if customer:
+            url_args['customer_id'] = customer.id
+        pager = portal_pager(
+            url='/my/agent/orders',
+            url_args=url_args,
+            total=order_count,
+            page=page,
+            step=self._items_per_page,
+        )
+
+        orders = SaleOrder.search_fetch(
+            domain,
+            ['name', 'date_order', 'partner_id', 'amount_total', 'currency_id', 'agent_order_status', 'state'],
+            order=searchbar_sortings[sortby]['order'],
+            limit=self._items_per_page,
+            offset=pager['offset'],
+        )
+        agent_metrics.set_records(len(orders))
+
+        values = {
+            'orders': orders,
+            'pager': pager,
+            'page_name': 'agent_orders',
+            'default_url': '/my/agent/orders',
+            'searchbar_sortings': searchbar_sortings,
+            'sortby': sortby,
+            'status': status,
+            'status_facets': [
+                (key, label, status_counts.get(key, 0)) for key, label in status_labels.items()
+                if status_counts.get(key)
+            ],
+            'status_labels': status_labels,
+            'order_count': sum(status_counts.values()),
+            'customer': customer,
+            'url_args': url_args,
+        }
+        return request.render('NPAL_portal_sale_mod.portal_my_agent_orders', values)
+
+    @http.route(['/my/agent/orders/export'], type='http', auth='user', website=True, methods=['GET'], sitemap=False)
+    @instrument('customer_portal_agent.portal_export_agent_orders')
+    def portal_export_agent_orders(self, date_from=None, date_to=None, status=None, customer_id=None, lines=None, **kw):
+        """
+        Export CSV degli ordini dell'agente (con lines=1 una riga per riga
+        d'ordine), filtrabile per intervallo di date, stato operativo e cliente.
+        La risposta è generata in streaming a blocchi ordinati per id: la
+        memoria resta costante qualunque sia il numero di righe.
+        """
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
+            return request.redirect('/my')
+
+        domain = [('created_by_agent_id', '=', agent_context.partner.id)]
+        if status in dict(request.env['sale.order']._fields['agent_order_status'].selection):
+            domain.append(('agent_order_status', '=', status))
+        customer = self._get_agent_order_customer(agent_context, customer_id)
+        if customer:
+            domain.append(('partner_id', '=', customer.id))
+        try:
+            if date_from:
+                domain.append(('date_order', '>=', fields.Date.to_date(date_from)))
+            if date_to:
+                domain.append(('date_order', '<', fields.Date.to_date(date_to) + timedelta(days=1)))
+        except ValueError:
+            return request.redirect('/my/agent/orders')
+
+        filename = 'ordini_agente_%s.csv' % fields.Date.to_string(fields.Date.context_today(request.env.user))
+        rows = self._generate_agent_orders_csv(
+            request.env.cr.dbname, request.env.uid, dict(request.env.context), domain, lines == '1')
+        return request.make_response(rows, headers=[
+            ('Content-Type', 'text/csv; charset=utf-8'),
+            ('Content-Disposition', content_disposition(filename)),
+            ('Cache-Control', 'no-store'),
+        ])
+
+    def _generate_agent_orders_csv(self, dbname, uid, context, domain, with_lines):
+        """
+        Generatore del CSV. Viene consumato dopo la chiusura del cursore della
+        richiesta, quindi usa un cursore proprio; gli ordini sono letti con
+        search_fetch a blocchi per id crescente e la cache viene svuotata a
+        ogni blocco. Le date sono nel fuso orario dell'utente.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+
+        def flush():
+            data = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            return data
+
+        header = ['Ordine', 'Data', 'Cliente', 'Stato Operativo', 'Stato', 'Data Consegna',
+                  'Imponibile', 'Totale', 'Valuta']
+        if with_lines:
+            header += ['Codice Prodotto', 'Descrizione', 'Quantità', 'UdM', 'Prezzo Unitario', 'Sconto %', 'Subtotale']
+        # BOM: Excel riconosce la codifica UTF-8
+        yield '\ufeff'.encode()
+        writer.writerow(header)
+        yield flush()
+
+        with Registry(dbname).cursor() as cr:
+            env = api.Environment(cr, uid, context, su=True)
+            SaleOrder = env['sale.order']
+            status_labels = dict(SaleOrder._fields['agent_order_status'].selection)
+            state_labels = dict(SaleOrder._fields['state']._description_selection(env))
+
+            def format_datetime(record, value):
+                if not value:
+                    return ''
+                return fields.Datetime.context_timestamp(record, value).strftime('%Y-%m-%d %H:%M:%S')
+
+            last_id = 0
+            while True:
+                orders = SaleOrder.search_fetch(
+                    domain + [('id', '>', last_id)], AGENT_EXPORT_ORDER_FIELDS,
+                    order='id', limit=AGENT_EXPORT_BATCH_SIZE,
+                )
+                if not orders:
+                    break
+                last_id = orders[-1].id
+
+                lines_by_order = {}
+                if with_lines:
+                    order_lines = env['sale.order.line'].search_fetch(
+                        [('order_id', 'in', orders.ids), ('display_type', '=', False)],
+                        AGENT_EXPORT_LINE_FIELDS, order='order_id, sequence, id',
+                    )
+                    for line in order_lines:
+                        lines_by_order.setdefault(line.order_id.id, []).append(line)
+
+                for order in orders:
+                    order_row = [
+                        _csv_text(order.name),
+                        format_datetime(order, order.date_order),
+                        _csv_text(order.partner_id.name),
+                        status_labels.get(order.agent_order_status, ''),
+                        state_labels.get(order.state, ''),
+                        format_datetime(order, order.commitment_date),
+                        order.amount_untaxed,
+                        order.amount_total,
+                        order.currency_id.name,
+                    ]
+                    if not with_lines:
+                        writer.writerow(order_row)
+                        continue
+                    for line in lines_by_order.get(order.id, []):
+                        writer.writerow(order_row + [
+                            _csv_text(line.product_id.default_code),
+                            _csv_text(line.name),
+                            line.product_uom_qty,
+                            _csv_text(line.product_uom.name),
+                            line.price_unit,
+                            line.discount,
+                            line.price_subtotal,
+                        ])
+                yield flush()
+                env.invalidate_all()
 
     @http.route(['/my/orders/new'], type='http', auth='user', website=True)
+    @instrument('customer_portal_agent.portal_create_order')
     def portal_create_order(self, customer_id=None, **kw):
         """
         Pagina per creare un nuovo ordine per un cliente.
         Mostra la selezione del cliente e poi reindirizza al checkout.
         """
-        if request.env.user._is_public() or not request.env.user.has_group('base.group_portal'):
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return request.redirect('/my')
 
-        partner = request.env.user.partner_id
-        customers = partner.get_agent_customers()
+        customers = agent_context.partner.get_agent_customers()
 
         if not customers:
             return request.render('NPAL_portal_sale_mod.portal_no_customers', {})
@@ -52,67 +290,125 @@ class CustomerPortalAgent(CustomerPortal):
             if customer not in customers:
                 raise AccessError(_("Non hai il permesso di creare ordini per questo cliente."))
 
-            # Salva il cliente selezionato nella sessione
-            request.session['agent_selected_customer_id'] = customer_id
-
-            # Reindirizza allo shop
-            return request.redirect('/shop')
+            # Seleziona il cliente (riprendendo l'eventuale carrello parcheggiato) e reindirizza
+            return request.redirect(self._switch_agent_customer(agent_context, customer.sudo()))
 
         # Mostra il form di selezione cliente
         values = {
             'customers': customers,
+            'recent_customers': agent_context.get_recent_customers(),
             'page_name': 'create_order',
         }
 
         return request.render('NPAL_portal_sale_mod.portal_select_customer', values)
 
     @http.route(['/my/orders/clear_customer'], type='json', auth='user')
+    @instrument('customer_portal_agent.portal_clear_selected_customer')
     def portal_clear_selected_customer(self, **kw):
         """
         Rimuove il cliente selezionato dalla sessione.
         """
-        if 'agent_selected_customer_id' in request.session:
-            del request.session['agent_selected_customer_id']
+        request.env.user._get_agent_context().clear_customer()
         return {'status': 'ok'}
 
+    def _switch_agent_customer(self, agent_context, customer):
+        """
+        Passa al cliente dato (il carrello corrente viene parcheggiato e
+        quello del nuovo cliente ripreso, vedi AgentContext.select_customer).
+        Restituisce l'URL di destinazione: il carrello ripreso, altrimenti
+        l'ordine rapido.
+        """
+        if customer == agent_context.customer:
+            order = request.website.sale_get_order()
+            return '/shop/cart' if order and order.order_line else '/shop/agent/quick'
+        restored = agent_context.select_customer(customer.id)
+        return '/shop/cart' if restored else '/shop/agent/quick'
+
+    @http.route(['/my/orders/switch_customer'], type='http', auth='user', website=True, methods=['POST'])
+    @instrument('customer_portal_agent.portal_switch_customer')
+    def portal_switch_customer(self, customer_id=None, **kw):
+        """
+        Cambio cliente in un'unica richiesta dai clienti recenti: verifica il
+        solo cliente scelto (senza caricare l'elenco clienti), parcheggia il
+        carrello corrente e riprende quello del nuovo cliente.
+        """
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
+            return request.redirect('/my')
+
+        customer = self._get_agent_order_customer(agent_context, customer_id)
+        if not customer:
+            raise AccessError(_("Non hai il permesso di creare ordini per questo cliente."))
+
+        return request.redirect(self._switch_agent_customer(agent_context, customer.sudo()))
+
+    @http.route(['/my/orders/recent_customers'], type='http', auth='user', website=True, methods=['GET'], sitemap=False)
+    @instrument('customer_portal_agent.portal_recent_customers')
+    def portal_recent_customers(self, **kw):
+        """
+        Clienti recenti dell'agente per il menu della barra del cliente
+        selezionato, caricati solo all'apertura del menu (non a ogni pagina).
+        """
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
+            return request.make_json_response({'error': 'Forbidden'}, status=403)
+
+        customer_id = agent_context.customer_id
+        recent_customers = [
+            recent for recent in agent_context.get_recent_customers() if recent['id'] != customer_id
+        ]
+        response = request.make_json_response({'customers': recent_customers})
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
     @http.route(['/my/orders/change_customer'], type='http', auth='user', website=True)
+    @instrument('customer_portal_agent.portal_change_customer')
     def portal_change_customer(self, **kw):
         """
-        Permette di cambiare il cliente selezionato.
-        Se c'è un ordine in corso, lo salva prima.
+        Permette di cambiare il cliente selezionato dall'elenco completo.
+        Il carrello in corso viene parcheggiato per il cliente corrente.
         """
-        if request.env.user._is_public() or not request.env.user.has_group('base.group_portal'):
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return request.redirect('/my')
 
-        # Se c'è un ordine in corso, salvalo
-        order = request.website.sale_get_order()
-        if order and order.order_line:
-            # L'ordine rimane in stato draft/sent, accessibile dall'agente
-            # Reset del carrello per permettere nuovo ordine con altro cliente
-            request.website.sale_reset()
-
-        # Rimuovi il cliente selezionato dalla sessione
-        if 'agent_selected_customer_id' in request.session:
-            del request.session['agent_selected_customer_id']
+        agent_context.park_cart()
+        agent_context.clear_customer()
 
         # Reindirizza alla selezione del nuovo cliente
         return request.redirect('/my/orders/new')
 
     @http.route(['/my/orders/add_address'], type='http', auth='user', website=True, methods=['POST'])
+    @instrument('customer_portal_agent.portal_add_shipping_address')
     def portal_add_shipping_address(self, **post):
         """
         Aggiunge un nuovo indirizzo di spedizione per un cliente.
         """
-        if request.env.user._is_public() or not request.env.user.has_group('base.group_portal'):
+        agent_context = request.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return request.redirect('/my')
 
-        customer_id = request.session.get('agent_selected_customer_id') or post.get('customer_id')
-        if not customer_id:
+        customer = agent_context.customer
+        if not customer and post.get('customer_id'):
+            customer = request.env['res.partner'].sudo().browse(int(post.get('customer_id'))).exists()
+        if not customer:
             return request.redirect('/my/orders/new')
 
-        customer = request.env['res.partner'].sudo().browse(int(customer_id))
-        if not customer.exists():
-            return request.redirect('/my/orders/new')
+        # Riusa l'indirizzo di consegna se il cliente lo ha già (stesso indirizzo normalizzato)
+        country_id = int(post.get('country_id')) if post.get('country_id') else customer.country_id.id
+        existing_address = customer.sudo()._find_agent_delivery_address(
+            post.get('street'), post.get('zip'), post.get('city'), country_id)
+        if existing_address:
+            # Nome e provincia aggiornati se diversi; l'indirizzo viene preselezionato nella finalizzazione
+            address_vals = {}
+            if post.get('address_name') and post.get('address_name') != existing_address.name:
+                address_vals['name'] = post.get('address_name')
+            if post.get('state_id') and int(post.get('state_id')) != existing_address.state_id.id:
+                address_vals['state_id'] = int(post.get('state_id'))
+            if address_vals:
+                existing_address.write(address_vals)
+                pin_primary()
+            return request.redirect('/shop/agent/cart/finalize?shipping_address_id=%s' % existing_address.id)
 
         # Crea il nuovo indirizzo come child del cliente
         address_vals = {
@@ -135,6 +431,8 @@ class CustomerPortalAgent(CustomerPortal):
             address_vals['state_id'] = int(post.get('state_id'))
 
         new_address = request.env['res.partner'].sudo().create(address_vals)
+        # La pagina di finalizzazione deve vedere subito il nuovo indirizzo: letture sul primario
+        pin_primary()
 
-        # Reindirizza alla pagina di finalizzazione
-        return request.redirect('/shop/agent/cart/finalize')
+        # Reindirizza alla pagina di finalizzazione con il nuovo indirizzo preselezionato
+        return request.redirect('/shop/agent/cart/finalize?shipping_address_id=%s' % new_address.id)
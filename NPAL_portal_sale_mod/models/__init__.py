@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from . import sale_order
+from . import sale_order_line
 from . import res_partner
+from . import res_users
 from . import res_config_settings
+from . import agent_pricelist_price
+from . import product_pricelist
+from . import product
+from . import agent_stock_availability
+from . import stock_quant
+from . import agent_order_activity
+from . import agent_customer_product
+from . import agent_recent_customer
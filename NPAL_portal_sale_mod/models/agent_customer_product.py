@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Righe d'ordine confermate per cliente e prodotto: un ordine conta una volta
+# e l'ultima quantità è quella dell'ordine più recente
+_FREQUENCY_SELECT = """
+    WITH order_products AS (
+        SELECT o.partner_id, l.product_id, o.id AS order_id, o.date_order, SUM(l.product_uom_qty) AS qty
+          FROM sale_order_line l
+          JOIN sale_order o ON o.id = l.order_id
+         WHERE l.product_id IS NOT NULL
+           AND l.display_type IS NULL
+           AND %s
+      GROUP BY o.partner_id, l.product_id, o.id, o.date_order
+    )
+    SELECT DISTINCT ON (partner_id, product_id)
+           partner_id, product_id,
+           COUNT(*) OVER (PARTITION BY partner_id, product_id),
+           qty, date_order
+      FROM order_products
+  ORDER BY partner_id, product_id, date_order DESC, order_id DESC
+"""
+
+
+class AgentCustomerProduct(models.Model):
+    """
+    Prodotti ordinati da ciascun cliente: numero di ordini confermati che li
+    contengono, quantità e data dell'ultimo ordine. Aggiornata alla conferma
+    degli ordini, letta dalla pagina di ordine rapido degli agenti senza
+    scorrere lo storico ordini.
+    """
+    _name = 'agent.customer.product'
+    _description = 'Prodotto ordinato dal cliente (portale agenti)'
+    _log_access = False
+
+    partner_id = fields.Many2one('res.partner', string='Cliente', required=True, ondelete='cascade')
+    product_id = fields.Many2one('product.product', string='Prodotto', required=True, ondelete='cascade')
+    order_count = fields.Integer(string='Numero Ordini')
+    last_qty = fields.Float(string='Ultima Quantità', digits='Product Unit of Measure')
+    last_date = fields.Datetime(string='Data Ultimo Ordine')
+
+    _sql_constraints = [
+        ('partner_product_uniq', 'unique(partner_id, product_id)',
+         'Esiste già una riga per questo cliente e prodotto.'),
+    ]
+
+    @api.model
+    def _update_from_orders(self, orders):
+        """Aggiunge alla tabella le righe degli ordini appena confermati."""
+        if not orders:
+            return
+        orders.order_line.flush_recordset(['product_id', 'product_uom_qty', 'display_type', 'order_id'])
+        orders.flush_recordset(['partner_id', 'date_order'])
+        self.env.cr.execute("""
+            INSERT INTO agent_customer_product (partner_id, product_id, order_count, last_qty, last_date)
+            %s
+            ON CONFLICT (partner_id, product_id) DO UPDATE
+               SET order_count = agent_customer_product.order_count + EXCLUDED.order_count,
+                   last_qty = CASE WHEN EXCLUDED.last_date >= agent_customer_product.last_date
+                                   THEN EXCLUDED.last_qty ELSE agent_customer_product.last_qty END,
+                   last_date = GREATEST(agent_customer_product.last_date, EXCLUDED.last_date)
+        """ % (_FREQUENCY_SELECT % "o.id IN %s"), [tuple(orders.ids)])
+        self.invalidate_model()
+
+    @api.model
+    def _cron_rebuild_agent_customer_products(self):
+        """
+        Ricostruzione completa dagli ordini confermati: popola la tabella
+        all'installazione e riallinea ordini annullati o riconfermati.
+        """
+        start = time.perf_counter()
+        self.env.flush_all()
+        self.env.cr.execute("DELETE FROM agent_customer_product")
+        self.env.cr.execute("""
+            INSERT INTO agent_customer_product (partner_id, product_id, order_count, last_qty, last_date)
+            %s
+        """ % (_FREQUENCY_SELECT % "o.state = 'sale'"))
+        self.invalidate_model()
+        _logger.info(
+            '[AGENT ORDER] Prodotti frequenti clienti ricostruiti: %s righe in %.3fs',
+            self.env.cr.rowcount, time.perf_counter() - start,
+        )
+
+    @api.model
+    def _get_quick_order_rows(self, partner, pricelist, warehouses, limit):
+        """
+        Prodotti più ordinati dal cliente, ancora vendibili e pubblicati, con
+        prezzo dalla tabella prezzi del listino (quantità 1) e disponibilità
+        nei magazzini dati, in un'unica query. Il prezzo è None se il prodotto
+        non è in tabella. Restituisce una lista di dict ordinata per frequenza.
+        """
+        self.env.cr.execute("""
+            SELECT f.product_id, f.order_count, f.last_qty, f.last_date,
+                   (SELECT pp.price
+                      FROM agent_pricelist_price pp
+                     WHERE pp.pricelist_id = %(pricelist_id)s
+                       AND pp.product_id = f.product_id
+                       AND pp.min_quantity <= 1
+                  ORDER BY pp.min_quantity DESC
+                     LIMIT 1),
+                   (SELECT COALESCE(SUM(a.quantity - a.reserved_quantity), 0)
+                      FROM agent_stock_availability a
+                     WHERE a.product_id = f.product_id
+                       AND a.warehouse_id IN %(warehouse_ids)s)
+              FROM agent_customer_product f
+              JOIN product_product p ON p.id = f.product_id AND p.active
+              JOIN product_template t ON t.id = p.product_tmpl_id
+                                     AND t.active AND t.sale_ok AND t.is_published
+             WHERE f.partner_id = %(partner_id)s
+          ORDER BY f.order_count DESC, f.last_date DESC, f.product_id
+             LIMIT %(limit)s
+        """, {
+            'pricelist_id': pricelist.id,
+            'partner_id': partner.id,
+            'warehouse_ids': tuple(warehouses.ids) or (0,),
+            'limit': limit,
+        })
+        return [{
+            'product_id': product_id,
+            'order_count': order_count,
+            'last_qty': last_qty,
+            'last_date': last_date,
+            'price': price,
+            'available': available,
+        } for product_id, order_count, last_qty, last_date, price, available in self.env.cr.fetchall()]
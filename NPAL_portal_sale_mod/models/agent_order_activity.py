@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+# Giorni dopo i quali le prenotazioni vengono eliminate dal cron ordini fermi
+AGENT_ACTIVITY_RETENTION_DAYS = 90
+
+
+class AgentOrderActivity(models.Model):
+    """
+    Prenotazione delle attività automatiche sugli ordini agente: una riga per
+    (ordine, tipo, utente, periodo). Il vincolo di unicità garantisce che,
+    anche con più worker o transazioni concorrenti, una sola transazione
+    crei l'attività di un dato periodo.
+    """
+    _name = 'agent.order.activity'
+    _description = 'Attività automatica ordine agente'
+    _log_access = False
+
+    order_id = fields.Many2one('sale.order', string='Ordine', required=True, ondelete='cascade')
+    kind = fields.Selection([
+        ('confirmation', 'Conferma ordine'),
+        ('stale', 'Ordine fermo'),
+    ], string='Tipo', required=True)
+    user_id = fields.Many2one('res.users', string='Utente', required=True, ondelete='cascade')
+    period = fields.Char(string='Periodo', required=True)
+    claim_date = fields.Datetime(string='Data Prenotazione')
+
+    _sql_constraints = [
+        ('order_kind_user_period_uniq', 'unique(order_id, kind, user_id, period)',
+         'Attività già prenotata per questo ordine, tipo, utente e periodo.'),
+    ]
+
+    @api.model
+    def _claim(self, kind, keys):
+        """
+        Prenota le attività (order_id, user_id, period) del tipo dato con
+        INSERT ... ON CONFLICT DO NOTHING. Restituisce l'insieme delle chiavi
+        (order_id, user_id) prenotate da questa transazione: le altre esistono
+        già o sono state prenotate da una transazione concorrente.
+        """
+        if not keys:
+            return set()
+        now = fields.Datetime.now()
+        rows = [(order_id, kind, user_id, period, now) for order_id, user_id, period in keys]
+        self.env.cr.execute("""
+            INSERT INTO agent_order_activity (order_id, kind, user_id, period, claim_date)
+            VALUES %s
+       ON CONFLICT (order_id, kind, user_id, period) DO NOTHING
+         RETURNING order_id, user_id
+        """ % ", ".join(["%s"] * len(rows)), rows)
+        return set(self.env.cr.fetchall())
+
+    @api.model
+    def _release(self, kind, keys):
+        """
+        Annulla le prenotazioni (order_id, user_id, period) del tipo dato la cui
+        attività non è stata creata: il periodo resta libero per il giro successivo.
+        """
+        if not keys:
+            return
+        self.env.cr.execute("""
+            DELETE FROM agent_order_activity
+             WHERE kind = %s
+               AND (order_id, user_id, period) IN %s
+        """, [kind, tuple(keys)])
+
+    @api.model
+    def _gc_claims(self):
+        """Elimina le prenotazioni più vecchie del periodo di conservazione."""
+        self.env.cr.execute(
+            "DELETE FROM agent_order_activity WHERE claim_date < %s",
+            [fields.Datetime.now() - timedelta(days=AGENT_ACTIVITY_RETENTION_DAYS)],
+        )
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from datetime import datetime, timezone
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Prodotti calcolati per blocco durante la ricostruzione della tabella
+PRICE_TABLE_BATCH_SIZE = 1000
+# Oltre questo numero di prodotti l'aggiornamento viene delegato al cron
+PRICE_TABLE_SYNC_LIMIT = 1000
+
+
+class AgentPricelistPrice(models.Model):
+    """
+    Tabella precalcolata (listino, prodotto, quantità minima) -> prezzo.
+    Letta dallo shop e dal carrello al posto del calcolo delle regole di
+    listino; per una quantità q vale la riga con la quantità minima più alta
+    non superiore a q. Le regole con validità a date sono valutate alla data
+    di calcolo: il cron giornaliero ricostruisce l'intera tabella.
+    """
+    _name = 'agent.pricelist.price'
+    _description = 'Prezzo precalcolato per listino (portale agenti)'
+    _log_access = False
+
+    pricelist_id = fields.Many2one('product.pricelist', string='Listino', required=True, ondelete='cascade')
+    product_id = fields.Many2one('product.product', string='Prodotto', required=True, ondelete='cascade', index=True)
+    min_quantity = fields.Float(string='Quantità Minima', required=True, default=0.0)
+    price = fields.Float(string='Prezzo', required=True, digits='Product Price')
+    item_id = fields.Many2one('product.pricelist.item', string='Regola', ondelete='set null')
+    price_date = fields.Datetime(string='Data Variazione Prezzo', help='Ultima volta in cui il prezzo della riga è cambiato')
+    refresh_date = fields.Datetime(string='Data Ricalcolo')
+
+    _sql_constraints = [
+        ('pricelist_product_qty_uniq', 'unique(pricelist_id, product_id, min_quantity)',
+         'Esiste già un prezzo per questo listino, prodotto e quantità.'),
+    ]
+
+    @api.model
+    def _get_base_pricelists(self, pricelists):
+        """Listini da cui i listini dati derivano (regole basate su altro listino), inclusi."""
+        result = pricelists
+        todo = pricelists
+        while todo:
+            bases = todo.item_ids.filtered(lambda item: item.base == 'pricelist').base_pricelist_id - result
+            result |= bases
+            todo = bases
+        return result
+
+    @api.model
+    def _get_dependent_pricelists(self, pricelists):
+        """Listini che derivano dai listini dati, inclusi."""
+        Item = self.env['product.pricelist.item'].sudo()
+        result = pricelists
+        todo = pricelists
+        while todo:
+            dependents = Item.search([
+                ('base', '=', 'pricelist'),
+                ('base_pricelist_id', 'in', todo.ids),
+            ]).pricelist_id - result
+            result |= dependents
+            todo = dependents
+        return result
+
+    @api.model
+    def _get_quantity_breaks(self, pricelist):
+        """Quantità minime in cui il prezzo del listino può cambiare."""
+        items = self._get_base_pricelists(pricelist).item_ids
+        return sorted({0.0} | set(items.mapped('min_quantity')))
+
+    @api.model
+    def _refresh(self, pricelists, products=None):
+        """
+        Ricalcola le righe dei listini dati, limitandosi ai prodotti indicati
+        (tutti i prodotti attivi se products è None).
+        """
+        pricelists = pricelists.sudo().filtered('agent_price_table')
+        if not pricelists:
+            return
+
+        Product = self.env['product.product'].sudo()
+        cr = self.env.cr
+        # Timestamp con microsecondi: distingue le righe non toccate da questo ricalcolo
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        for pricelist in pricelists:
+            start = time.perf_counter()
+            pricelist_products = Product.search([]) if products is None else products.sudo().exists()
+
+            compute_pricelist = pricelist.with_context(agent_price_table_bypass=True)
+            breaks = self._get_quantity_breaks(pricelist)
+            for offset in range(0, len(pricelist_products), PRICE_TABLE_BATCH_SIZE):
+                batch = pricelist_products[offset:offset + PRICE_TABLE_BATCH_SIZE]
+                rows = []
+                for quantity in breaks:
+                    for product_id, (price, rule_id) in compute_pricelist._compute_price_rule(batch, quantity).items():
+                        rows.append((pricelist.id, product_id, quantity, price, rule_id or None, now, now))
+                if rows:
+                    # Upsert: price_date cambia solo se il prezzo è effettivamente variato
+                    cr.execute("""
+                        INSERT INTO agent_pricelist_price
+                               (pricelist_id, product_id, min_quantity, price, item_id, price_date, refresh_date)
+                        VALUES %s
+                   ON CONFLICT (pricelist_id, product_id, min_quantity) DO UPDATE
+                           SET price = EXCLUDED.price,
+                               item_id = EXCLUDED.item_id,
+                               refresh_date = EXCLUDED.refresh_date,
+                               price_date = CASE WHEN agent_pricelist_price.price = EXCLUDED.price
+                                                 THEN agent_pricelist_price.price_date
+                                                 ELSE EXCLUDED.price_date END
+                    """ % ", ".join(["%s"] * len(rows)), rows)
+                # Libera la cache dei prodotti già calcolati
+                batch.invalidate_recordset()
+
+            # Rimuove le righe non più valide (prodotti archiviati, quantità minime rimosse)
+            if products is None:
+                cr.execute(
+                    "DELETE FROM agent_pricelist_price WHERE pricelist_id = %s AND refresh_date < %s",
+                    [pricelist.id, now],
+                )
+                pricelist.agent_price_table_dirty = False
+            elif pricelist_products:
+                cr.execute(
+                    "DELETE FROM agent_pricelist_price WHERE pricelist_id = %s AND product_id IN %s AND refresh_date < %s",
+                    [pricelist.id, tuple(pricelist_products.ids), now],
+                )
+            _logger.debug(
+                '[AGENT PRICE] Listino %s: %s prodotti, %s quantità ricalcolati in %.3fs',
+                pricelist.id, len(pricelist_products), len(breaks), time.perf_counter() - start,
+            )
+
+        self.invalidate_model()
+
+    @api.model
+    def _refresh_products(self, products, pricelists=None):
+        """
+        Aggiorna le righe dei prodotti modificati. Per insiemi grandi i listini
+        vengono marcati da ricalcolare e aggiornati dal cron.
+        """
+        if pricelists is None:
+            pricelists = self.env['product.pricelist'].sudo().search([('agent_price_table', '=', True)])
+        if not pricelists or not products:
+            return
+        if len(products) > PRICE_TABLE_SYNC_LIMIT:
+            pricelists._mark_agent_price_table_dirty()
+        else:
+            self._refresh(pricelists, products)
+
+    @api.model
+    def _lookup(self, pricelist, products, quantity):
+        """
+        Prezzi precalcolati per i prodotti (varianti) dati alla quantità data.
+        Restituisce {product_id: (price, item_id)} solo per i prodotti presenti.
+        """
+        if not products:
+            return {}
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (product_id) product_id, price, item_id
+              FROM agent_pricelist_price
+             WHERE pricelist_id = %s
+               AND product_id IN %s
+               AND min_quantity <= %s
+          ORDER BY product_id, min_quantity DESC
+        """, [pricelist.id, tuple(products.ids), quantity])
+        return {product_id: (price, item_id or False) for product_id, price, item_id in self.env.cr.fetchall()}
+
+    @api.model
+    def _get_changed_product_ids(self, pricelist, since):
+        """ID dei prodotti il cui prezzo nel listino è cambiato dopo `since`."""
+        self.env.cr.execute("""
+            SELECT DISTINCT product_id
+              FROM agent_pricelist_price
+             WHERE pricelist_id = %s
+               AND price_date > %s
+        """, [pricelist.id, since])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _cron_refresh_agent_price_table(self, full=False):
+        """
+        Ricostruisce i listini marcati da ricalcolare; con full=True ricostruisce
+        tutti i listini abilitati (riallineamento giornaliero, regole a date).
+        """
+        start = time.perf_counter()
+        domain = [('agent_price_table', '=', True)]
+        if not full:
+            domain.append(('agent_price_table_dirty', '=', True))
+        pricelists = self.env['product.pricelist'].sudo().search(domain)
+        if full:
+            self.env['product.pricelist']._clear_agent_price_table_dated_cache()
+            self.env.cr.execute(
+                "DELETE FROM agent_pricelist_price WHERE pricelist_id NOT IN %s",
+                [tuple(pricelists.ids) or (0,)],
+            )
+        self._refresh(pricelists)
+        _logger.info(
+            '[AGENT PRICE] Tabella prezzi ricostruita per %s listini in %.3fs',
+            len(pricelists), time.perf_counter() - start,
+        )
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+# Clienti recenti mostrati e conservati per agente (le righe con un carrello parcheggiato restano comunque)
+AGENT_RECENT_CUSTOMERS_LIMIT = 8
+
+
+class AgentRecentCustomer(models.Model):
+    """
+    Clienti selezionati di recente da ciascun agente, dal più recente, con
+    l'eventuale carrello parcheggiato quando l'agente è passato a un altro
+    cliente: al ritorno sul cliente il carrello viene ripreso.
+    """
+    _name = 'agent.recent.customer'
+    _description = 'Cliente recente agente (portale agenti)'
+    _log_access = False
+
+    user_id = fields.Many2one('res.users', string='Agente', required=True, ondelete='cascade')
+    partner_id = fields.Many2one('res.partner', string='Cliente', required=True, ondelete='cascade')
+    parked_order_id = fields.Many2one('sale.order', string='Carrello Parcheggiato', ondelete='set null')
+    last_used = fields.Datetime(string='Ultima Selezione')
+
+    _sql_constraints = [
+        ('user_partner_uniq', 'unique(user_id, partner_id)',
+         'Esiste già una riga per questo agente e cliente.'),
+    ]
+
+    @api.model
+    def _touch(self, user, partner_id):
+        """Porta il cliente in cima ai recenti dell'agente ed elimina i più vecchi oltre il limite."""
+        self.env.cr.execute("""
+            INSERT INTO agent_recent_customer (user_id, partner_id, last_used)
+            VALUES (%(user_id)s, %(partner_id)s, %(now)s)
+            ON CONFLICT (user_id, partner_id) DO UPDATE SET last_used = EXCLUDED.last_used
+        """, {'user_id': user.id, 'partner_id': partner_id, 'now': fields.Datetime.now()})
+        self.env.cr.execute("""
+            DELETE FROM agent_recent_customer
+             WHERE id IN (SELECT id
+                            FROM (SELECT id, parked_order_id,
+                                         row_number() OVER (ORDER BY last_used DESC, id DESC) AS position
+                                    FROM agent_recent_customer
+                                   WHERE user_id = %(user_id)s) recent
+                           WHERE position > %(limit)s
+                             AND parked_order_id IS NULL)
+        """, {'user_id': user.id, 'limit': AGENT_RECENT_CUSTOMERS_LIMIT})
+        self.invalidate_model()
+
+    @api.model
+    def _park_order(self, user, partner_id, order):
+        """Parcheggia il carrello dell'agente per il cliente (sostituisce quello già parcheggiato)."""
+        self.env.cr.execute("""
+            INSERT INTO agent_recent_customer (user_id, partner_id, parked_order_id, last_used)
+            VALUES (%(user_id)s, %(partner_id)s, %(order_id)s, %(now)s)
+            ON CONFLICT (user_id, partner_id) DO UPDATE SET parked_order_id = EXCLUDED.parked_order_id
+        """, {'user_id': user.id, 'partner_id': partner_id, 'order_id': order.id, 'now': fields.Datetime.now()})
+        self.invalidate_model()
+
+    @api.model
+    def _pop_parked_order(self, user, partner_id):
+        """
+        Riprende il carrello parcheggiato per il cliente, se è ancora in bozza,
+        e lo stacca dalla riga. Restituisce l'ordine (sudo) o un recordset vuoto.
+        """
+        self.env.cr.execute("""
+            UPDATE agent_recent_customer
+               SET parked_order_id = NULL
+             WHERE user_id = %s AND partner_id = %s AND parked_order_id IS NOT NULL
+         RETURNING parked_order_id
+        """, [user.id, partner_id])
+        row = self.env.cr.fetchone()
+        self.invalidate_model()
+        order = self.env['sale.order'].sudo().browse(row and row[0]).exists()
+        return order.filtered(lambda o: o.state == 'draft')
+
+    @api.model
+    def _get_recent_customers(self, user, agent_partner, limit=AGENT_RECENT_CUSTOMERS_LIMIT):
+        """
+        Clienti recenti dell'agente ancora a lui associati, dal più recente.
+        Restituisce una lista di dict {'id', 'name', 'parked'} (parked: carrello parcheggiato).
+        """
+        self.env.cr.execute("""
+            SELECT partner_id, parked_order_id IS NOT NULL
+              FROM agent_recent_customer
+             WHERE user_id = %s
+          ORDER BY last_used DESC, id DESC
+             LIMIT %s
+        """, [user.id, limit])
+        rows = self.env.cr.fetchall()
+        if not rows or not agent_partner.user_id:
+            return []
+        customers = self.env['res.partner'].sudo().search_fetch(
+            agent_partner._get_agent_customers_domain() + [('id', 'in', [partner_id for partner_id, _parked in rows])],
+            ['name'],
+        )
+        names = {customer.id: customer.name for customer in customers}
+        return [
+            {'id': partner_id, 'name': names[partner_id], 'parked': parked}
+            for partner_id, parked in rows if partner_id in names
+        ]
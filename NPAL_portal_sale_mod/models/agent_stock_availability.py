@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from datetime import datetime, timezone
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Chiave dei prodotti da accodare a fine transazione (cr.precommit.data)
+STOCK_AVAILABILITY_PENDING_KEY = 'agent.stock.availability.product_ids'
+# Prodotti ricalcolati per query durante l'aggiornamento incrementale
+STOCK_AVAILABILITY_BATCH_SIZE = 1000
+# Righe della coda elaborate per esecuzione del cron
+STOCK_AVAILABILITY_QUEUE_BATCH_SIZE = 5000
+
+
+class AgentStockAvailability(models.Model):
+    """
+    Tabella materializzata (prodotto, magazzino) -> quantità e riservato,
+    somma delle quant delle ubicazioni figlie dell'ubicazione di stock del
+    magazzino. I prodotti le cui quant sono cambiate vengono accodati
+    (agent.stock.availability.queue) e ricalcolati dal cron ogni minuto; la
+    tabella è riallineata per intero ogni notte.
+    """
+    _name = 'agent.stock.availability'
+    _description = 'Disponibilità per magazzino (portale agenti)'
+    _log_access = False
+
+    product_id = fields.Many2one('product.product', string='Prodotto', required=True, ondelete='cascade')
+    warehouse_id = fields.Many2one('stock.warehouse', string='Magazzino', required=True, ondelete='cascade')
+    quantity = fields.Float(string='Quantità', digits='Product Unit of Measure')
+    reserved_quantity = fields.Float(string='Quantità Riservata', digits='Product Unit of Measure')
+    change_date = fields.Datetime(string='Data Variazione', help='Ultima volta in cui quantità o riservato sono cambiati')
+    refresh_date = fields.Datetime(string='Data Ricalcolo')
+
+    _sql_constraints = [
+        ('product_warehouse_uniq', 'unique(product_id, warehouse_id)',
+         'Esiste già una disponibilità per questo prodotto e magazzino.'),
+    ]
+
+    @api.model
+    def _refresh(self, product_ids=None):
+        """
+        Ricalcola le righe dei prodotti indicati (tutti se product_ids è None)
+        dalle quant. Le righe senza più quant vengono azzerate, così la data
+        di variazione resta affidabile per il delta del catalogo.
+        """
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity'])
+        self.env['stock.location'].flush_model(['parent_path'])
+        self.env['stock.warehouse'].flush_model(['lot_stock_id', 'active'])
+
+        cr = self.env.cr
+        # Timestamp con microsecondi: distingue le righe non toccate da questo ricalcolo
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        product_filter = "AND q.product_id IN %(product_ids)s" if product_ids is not None else ""
+        stale_filter = "AND product_id IN %(product_ids)s" if product_ids is not None else ""
+        batches = [None] if product_ids is None else [
+            tuple(product_ids[offset:offset + STOCK_AVAILABILITY_BATCH_SIZE])
+            for offset in range(0, len(product_ids), STOCK_AVAILABILITY_BATCH_SIZE)
+        ]
+        for batch in batches:
+            params = {'now': now, 'product_ids': batch}
+            # Upsert: change_date cambia solo se quantità o riservato sono effettivamente variati
+            cr.execute("""
+                INSERT INTO agent_stock_availability
+                       (product_id, warehouse_id, quantity, reserved_quantity, change_date, refresh_date)
+                SELECT q.product_id, w.id, SUM(q.quantity), SUM(q.reserved_quantity), %%(now)s, %%(now)s
+                  FROM stock_quant q
+                  JOIN stock_location l ON l.id = q.location_id
+                  JOIN stock_warehouse w ON w.active
+                  JOIN stock_location ws ON ws.id = w.lot_stock_id
+                 WHERE l.parent_path LIKE ws.parent_path || '%%%%'
+                       %s
+              GROUP BY q.product_id, w.id
+           ON CONFLICT (product_id, warehouse_id) DO UPDATE
+                   SET quantity = EXCLUDED.quantity,
+                       reserved_quantity = EXCLUDED.reserved_quantity,
+                       refresh_date = EXCLUDED.refresh_date,
+                       change_date = CASE WHEN agent_stock_availability.quantity = EXCLUDED.quantity
+                                            AND agent_stock_availability.reserved_quantity = EXCLUDED.reserved_quantity
+                                          THEN agent_stock_availability.change_date
+                                          ELSE EXCLUDED.change_date END
+            """ % product_filter, params)
+            cr.execute("""
+                UPDATE agent_stock_availability
+                   SET quantity = 0, reserved_quantity = 0, change_date = %%(now)s, refresh_date = %%(now)s
+                 WHERE refresh_date < %%(now)s
+                   AND (quantity != 0 OR reserved_quantity != 0)
+                       %s
+            """ % stale_filter, params)
+
+        if product_ids is None:
+            # Righe già azzerate in un ricalcolo precedente
+            cr.execute("""
+                DELETE FROM agent_stock_availability
+                 WHERE refresh_date < %s AND quantity = 0 AND reserved_quantity = 0
+            """, [now])
+        self.invalidate_model()
+
+    @api.model
+    def _mark_products(self, product_ids):
+        """
+        Accoda i prodotti da riallineare. A fine transazione viene eseguito un
+        solo INSERT nella coda, senza vincoli di unicità: le transazioni di
+        magazzino concorrenti sugli stessi prodotti non si bloccano a vicenda
+        sulle righe della tabella.
+        """
+        product_ids = {product_id for product_id in product_ids if product_id}
+        if not product_ids:
+            return
+        precommit = self.env.cr.precommit
+        if STOCK_AVAILABILITY_PENDING_KEY not in precommit.data:
+            precommit.data[STOCK_AVAILABILITY_PENDING_KEY] = set()
+            precommit.add(self.sudo()._enqueue_pending)
+        precommit.data[STOCK_AVAILABILITY_PENDING_KEY].update(product_ids)
+
+    @api.model
+    def _enqueue_pending(self):
+        product_ids = self.env.cr.precommit.data.pop(STOCK_AVAILABILITY_PENDING_KEY, set())
+        if product_ids:
+            self.env.cr.execute(
+                "INSERT INTO agent_stock_availability_queue (product_id) SELECT unnest(%s::int[])",
+                [sorted(product_ids)],
+            )
+
+    @api.model
+    def _cron_apply_agent_stock_availability_queue(self):
+        """
+        Ricalcola i prodotti accodati. Le righe della coda vengono prese con
+        SKIP LOCKED ed eliminate nella stessa transazione del ricalcolo.
+        """
+        start = time.perf_counter()
+        cr = self.env.cr
+        cr.execute("""
+            DELETE FROM agent_stock_availability_queue
+             WHERE id IN (SELECT id
+                            FROM agent_stock_availability_queue
+                        ORDER BY id
+                           LIMIT %s
+                             FOR UPDATE SKIP LOCKED)
+         RETURNING product_id
+        """, [STOCK_AVAILABILITY_QUEUE_BATCH_SIZE])
+        product_ids = sorted({row[0] for row in cr.fetchall()})
+        if product_ids:
+            self._refresh(product_ids)
+        cr.execute("SELECT COUNT(*) FROM agent_stock_availability_queue")
+        remaining = cr.fetchone()[0]
+        _logger.debug(
+            '[AGENT STOCK] %s prodotti riallineati dalla coda in %.3fs (%s righe rimanenti)',
+            len(product_ids), time.perf_counter() - start, remaining,
+        )
+        self.env['ir.cron']._notify_progress(done=len(product_ids), remaining=remaining)
+
+    @api.model
+    def _lookup(self, products, warehouses):
+        """
+        Righe della tabella per i prodotti e magazzini dati.
+        Restituisce {(product_id, warehouse_id): (quantità, riservato, data variazione)}.
+        """
+        if not products or not warehouses:
+            return {}
+        self.env.cr.execute("""
+            SELECT product_id, warehouse_id, quantity, reserved_quantity, change_date
+              FROM agent_stock_availability
+             WHERE product_id IN %s
+               AND warehouse_id IN %s
+        """, [tuple(products.ids), tuple(warehouses.ids)])
+        return {
+            (product_id, warehouse_id): (quantity, reserved_quantity, change_date)
+            for product_id, warehouse_id, quantity, reserved_quantity, change_date in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _get_template_availability(self, templates, warehouses):
+        """Disponibilità (quantità - riservato) per template nei magazzini dati: {template_id: quantità}."""
+        if not templates or not warehouses:
+            return {}
+        self.env.cr.execute("""
+            SELECT p.product_tmpl_id, SUM(a.quantity - a.reserved_quantity)
+              FROM agent_stock_availability a
+              JOIN product_product p ON p.id = a.product_id
+             WHERE p.product_tmpl_id IN %s
+               AND a.warehouse_id IN %s
+          GROUP BY p.product_tmpl_id
+        """, [tuple(templates.ids), tuple(warehouses.ids)])
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _get_sale_availability(self, product_ids, warehouses):
+        """
+        Vendibilità e disponibilità dei prodotti in un'unica query: per ogni
+        prodotto (attivo, vendibile e pubblicato, quantità - riservato nei
+        magazzini dati). Restituisce {product_id: (vendibile, quantità)}.
+        """
+        if not product_ids:
+            return {}
+        self.env['product.product'].flush_model(['active', 'product_tmpl_id'])
+        self.env['product.template'].flush_model(['active', 'sale_ok', 'is_published'])
+        self.env.cr.execute("""
+            SELECT p.id,
+                   p.active AND t.active AND t.sale_ok AND COALESCE(t.is_published, FALSE),
+                   COALESCE(SUM(a.quantity - a.reserved_quantity), 0)
+              FROM product_product p
+              JOIN product_template t ON t.id = p.product_tmpl_id
+         LEFT JOIN agent_stock_availability a ON a.product_id = p.id AND a.warehouse_id IN %s
+             WHERE p.id IN %s
+          GROUP BY p.id, t.id
+        """, [tuple(warehouses.ids) or (0,), tuple(product_ids)])
+        return {product_id: (saleable, quantity) for product_id, saleable, quantity in self.env.cr.fetchall()}
+
+    @api.model
+    def _get_changed_product_ids(self, warehouses, since):
+        """ID dei prodotti la cui disponibilità nei magazzini dati è cambiata dopo `since`."""
+        if not warehouses:
+            return []
+        self.env.cr.execute("""
+            SELECT DISTINCT product_id
+              FROM agent_stock_availability
+             WHERE warehouse_id IN %s
+               AND change_date > %s
+        """, [tuple(warehouses.ids), since])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _cron_reconcile_agent_stock_availability(self):
+        """Riallineamento completo notturno: copre le quant modificate via SQL e le modifiche alle ubicazioni."""
+        start = time.perf_counter()
+        self._refresh()
+        _logger.info('[AGENT STOCK] Tabella disponibilità riallineata in %.3fs', time.perf_counter() - start)
+
+
+class AgentStockAvailabilityQueue(models.Model):
+    """Prodotti le cui quant sono cambiate, in attesa del ricalcolo della disponibilità."""
+    _name = 'agent.stock.availability.queue'
+    _description = 'Coda ricalcolo disponibilità per magazzino (portale agenti)'
+    _log_access = False
+
+    product_id = fields.Many2one('product.product', string='Prodotto', required=True, ondelete='cascade')
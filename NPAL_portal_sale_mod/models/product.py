@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+# Campi di prodotto da cui dipendono i prezzi di listino
+AGENT_PRICE_TEMPLATE_FIELDS = {'list_price', 'standard_price', 'categ_id', 'uom_id', 'active', 'currency_id'}
+AGENT_PRICE_PRODUCT_FIELDS = {'standard_price', 'active', 'product_template_attribute_value_ids'}
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        result = super().write(vals)
+        if {'categ_id', 'active'} & set(vals) and self.env['product.pricelist.item']._has_agent_dated_category_items():
+            self.env['product.pricelist']._clear_agent_price_table_dated_cache()
+        if AGENT_PRICE_TEMPLATE_FIELDS & set(vals):
+            self.env['agent.pricelist.price']._refresh_products(
+                self.with_context(active_test=False).product_variant_ids)
+        return result
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
+        # Le nuove varianti possono ricadere in una categoria con regole a date
+        if self.env['product.pricelist.item']._has_agent_dated_category_items():
+            self.env['product.pricelist']._clear_agent_price_table_dated_cache()
+        self.env['agent.pricelist.price']._refresh_products(products)
+        return products
+
+    def write(self, vals):
+        result = super().write(vals)
+        if 'active' in vals and self.env['product.pricelist.item']._has_agent_dated_category_items():
+            self.env['product.pricelist']._clear_agent_price_table_dated_cache()
+        if AGENT_PRICE_PRODUCT_FIELDS & set(vals):
+            self.env['agent.pricelist.price']._refresh_products(self)
+        return result
+
+
+class ProductTemplateAttributeValue(models.Model):
+    _inherit = 'product.template.attribute.value'
+
+    def write(self, vals):
+        result = super().write(vals)
+        if 'price_extra' in vals:
+            self.env['agent.pricelist.price']._refresh_products(
+                self.with_context(active_test=False).ptav_product_variant_ids)
+        return result
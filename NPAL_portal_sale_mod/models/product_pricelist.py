@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools
+
+# Chiave di contesto impostata dai controller agenti: solo queste richieste leggono la tabella prezzi
+AGENT_PRICE_TABLE_CONTEXT_KEY = 'agent_price_table'
+
+
+class ProductPricelist(models.Model):
+    _inherit = 'product.pricelist'
+
+    agent_price_table = fields.Boolean(
+        string='Tabella Prezzi Agenti',
+        default=True,
+        help='Mantiene una tabella di prezzi precalcolati per questo listino, '
+             'usata dallo shop e dal carrello al posto del calcolo delle regole',
+    )
+
+    agent_price_table_dirty = fields.Boolean(
+        string='Tabella Prezzi da Ricalcolare',
+        default=True,
+        copy=False,
+        readonly=True,
+        help='La tabella prezzi non è allineata: finché il cron non la ricostruisce '
+             'i prezzi vengono calcolati dalle regole',
+    )
+
+    def write(self, vals):
+        result = super().write(vals)
+        if {'currency_id', 'company_id', 'agent_price_table'} & set(vals):
+            self._mark_agent_price_table_dirty()
+        return result
+
+    def _mark_agent_price_table_dirty(self):
+        """Marca i listini (e quelli che ne derivano) da ricostruire dal cron."""
+        pricelists = self.env['agent.pricelist.price']._get_dependent_pricelists(self.sudo())
+        pricelists.filtered(lambda pricelist: not pricelist.agent_price_table_dirty).write({
+            'agent_price_table_dirty': True,
+        })
+
+    def _get_agent_price_table_dated_product_ids(self):
+        """
+        ID delle varianti coperte da regole con validità a date (anche dei
+        listini di base), per le quali la tabella può essere non aggiornata;
+        None se una di queste regole vale per tutti i prodotti. In cache per
+        listino: vedi _clear_agent_price_table_dated_cache().
+        """
+        self.ensure_one()
+        return self._get_agent_price_table_dated_product_ids_cached()
+
+    @tools.ormcache('self.id')
+    def _get_agent_price_table_dated_product_ids_cached(self):
+        items = self.env['agent.pricelist.price']._get_base_pricelists(self.sudo()).item_ids.filtered(
+            lambda item: item.date_start or item.date_end)
+        products = items._get_agent_price_table_products()
+        return None if products is None else frozenset(products.ids)
+
+    @api.model
+    def _clear_agent_price_table_dated_cache(self):
+        """Svuota la cache delle varianti coperte da regole a date (regole, categorie o prodotti cambiati)."""
+        self.env.registry.clear_cache()
+
+    def _can_use_agent_price_table(self, products, currency=None, date=False, uom=None, **kwargs):
+        self.ensure_one()
+        if not self.agent_price_table or self.agent_price_table_dirty:
+            return False
+        if self.env.context.get('agent_price_table_bypass'):
+            return False
+        if not (self.env.context.get(AGENT_PRICE_TABLE_CONTEXT_KEY)
+                or products.env.context.get(AGENT_PRICE_TABLE_CONTEXT_KEY)):
+            return False
+        if products.env.context.get('no_variant_attributes_price_extra'):
+            return False
+        if any(value is not True for value in kwargs.values()):
+            return False
+        if currency and currency != self.currency_id:
+            return False
+        if date and fields.Date.to_date(date) != fields.Date.context_today(self):
+            return False
+        if uom and any(product.uom_id != uom for product in products):
+            return False
+        return True
+
+    def _compute_price_rule(self, products, quantity, currency=None, date=False, uom=None, **kwargs):
+        """
+        Nelle richieste del portale agenti usa la tabella prezzi precalcolata
+        quando il calcolo richiesto coincide con quello memorizzato (valuta del
+        listino, UdM del prodotto, data odierna); i prodotti non presenti in
+        tabella o coperti da regole a date sono calcolati dalle regole.
+        I template con una sola variante usano il prezzo della variante.
+        """
+        if not self or not products or not self._can_use_agent_price_table(products, currency, date, uom, **kwargs):
+            return super()._compute_price_rule(products, quantity, currency=currency, date=date, uom=uom, **kwargs)
+        dated_ids = self._get_agent_price_table_dated_product_ids()
+        if dated_ids is None:
+            return super()._compute_price_rule(products, quantity, currency=currency, date=date, uom=uom, **kwargs)
+
+        if products._name == 'product.template':
+            variant_by_record = {
+                template.id: template.product_variant_id.id
+                for template in products if template.product_variant_count == 1
+            }
+        else:
+            variant_by_record = {product.id: product.id for product in products}
+
+        variants = self.env['product.product'].browse(set(variant_by_record.values()) - dated_ids)
+        prices = self.env['agent.pricelist.price'].sudo()._lookup(self, variants, quantity)
+
+        result = {}
+        missing_ids = []
+        for record in products:
+            variant_id = variant_by_record.get(record.id)
+            if variant_id in prices:
+                result[record.id] = prices[variant_id]
+            else:
+                missing_ids.append(record.id)
+
+        if missing_ids:
+            result.update(super()._compute_price_rule(
+                products.browse(missing_ids), quantity, currency=currency, date=date, uom=uom, **kwargs,
+            ))
+        return result
+
+
+class ProductPricelistItem(models.Model):
+    _inherit = 'product.pricelist.item'
+
+    def _get_agent_price_table_products(self):
+        """
+        Varianti il cui prezzo dipende da queste regole,
+        o None se almeno una regola vale per tutti i prodotti.
+        """
+        Product = self.env['product.product'].sudo()
+        products = Product
+        for item in self.sudo():
+            if item.applied_on == '0_product_variant':
+                products |= item.product_id
+            elif item.applied_on == '1_product':
+                products |= item.product_tmpl_id.product_variant_ids
+            elif item.applied_on == '2_product_category':
+                products |= Product.search([('categ_id', 'child_of', item.categ_id.id)])
+            else:
+                return None
+        return products
+
+    @api.model
+    def _has_agent_dated_category_items(self):
+        """True se esistono regole a date per categoria (dipendono dalle categorie dei prodotti)."""
+        return bool(self.sudo().search_count([
+            ('applied_on', '=', '2_product_category'),
+            '|', ('date_start', '!=', False), ('date_end', '!=', False),
+        ], limit=1))
+
+    def _refresh_agent_price_table(self, pricelists, products):
+        self.env['product.pricelist']._clear_agent_price_table_dated_cache()
+        PriceTable = self.env['agent.pricelist.price']
+        pricelists = PriceTable._get_dependent_pricelists(pricelists.sudo())
+        if products is None:
+            pricelists._mark_agent_price_table_dirty()
+        else:
+            PriceTable._refresh_products(products, pricelists.filtered('agent_price_table'))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        items = super().create(vals_list)
+        items._refresh_agent_price_table(items.pricelist_id, items._get_agent_price_table_products())
+        return items
+
+    def write(self, vals):
+        pricelists = self.pricelist_id
+        products = self._get_agent_price_table_products()
+        result = super().write(vals)
+        new_products = self._get_agent_price_table_products()
+        products = None if products is None or new_products is None else products | new_products
+        self._refresh_agent_price_table(pricelists | self.pricelist_id, products)
+        return result
+
+    def unlink(self):
+        pricelists = self.pricelist_id
+        products = self._get_agent_price_table_products()
+        result = super().unlink()
+        self._refresh_agent_price_table(pricelists.exists(), products)
+        return result
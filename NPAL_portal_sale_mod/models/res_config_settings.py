@@ -30,6 +30,12 @@ class ResConfigSettings(models.TransientModel):
         help='Numero di giorni dopo i quali un ordine fermo nello stesso stato genera un task',
     )
 
+    stale_digest_mode = fields.Boolean(
+        string='Riepilogo Ordini Fermi',
+        help='Invia a ogni utente un unico messaggio con gli ordini fermi raggruppati per stato '
+             'invece di un task per ordine',
+    )
+
     @api.model
     def get_values(self):
         res = super(ResConfigSettings, self).get_values()
@@ -58,6 +64,7 @@ class ResConfigSettings(models.TransientModel):
             task_confirmation_user_ids=[(6, 0, task_confirmation_user_ids)],
             task_stale_user_ids=[(6, 0, task_stale_user_ids)],
             stale_order_days=int(config.get_param('NPAL_portal_sale_mod.stale_order_days', '7')),
+            stale_digest_mode=bool(config.get_param('NPAL_portal_sale_mod.stale_digest_mode')),
         )
         return res
 
@@ -72,3 +79,4 @@ class ResConfigSettings(models.TransientModel):
         config.set_param('NPAL_portal_sale_mod.task_confirmation_user_ids', task_confirmation_user_ids_str)
         config.set_param('NPAL_portal_sale_mod.task_stale_user_ids', task_stale_user_ids_str)
         config.set_param('NPAL_portal_sale_mod.stale_order_days', self.stale_order_days)
+        config.set_param('NPAL_portal_sale_mod.stale_digest_mode', self.stale_digest_mode)
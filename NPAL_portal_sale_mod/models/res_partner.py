@@ -1,31 +1,155 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+
 from odoo import models, fields, api
 
+from ..tools.read_replica import replica_read
+
+_logger = logging.getLogger(__name__)
+
+# Gruppi di indirizzi duplicati uniti per esecuzione del job
+ADDRESS_MERGE_BATCH_SIZE = 500
+# Il wizard di unione di Odoo accetta al massimo 3 contatti per volta
+ADDRESS_MERGE_WIZARD_LIMIT = 3
+
 
 class ResPartner(models.Model):
     _inherit = 'res.partner'
 
+    agent_address_hash = fields.Char(
+        string='Impronta Indirizzo',
+        compute='_compute_agent_address_hash',
+        store=True,
+        index='btree_not_null',
+        copy=False,
+        help='Impronta normalizzata di via, CAP, città e paese degli indirizzi di consegna, '
+             'usata per riconoscere gli indirizzi già presenti',
+    )
+
+    @api.model
+    def _normalize_agent_address_part(self, value):
+        """Minuscolo, senza accenti e punteggiatura, spazi compattati."""
+        value = unicodedata.normalize('NFKD', value or '')
+        value = ''.join(char for char in value if not unicodedata.combining(char))
+        return ' '.join(re.sub(r'[^0-9a-z]+', ' ', value.lower()).split())
+
+    @api.model
+    def _get_agent_address_hash(self, street, zip_code, city, country_id):
+        """Impronta di un indirizzo, o False se via e città sono vuote."""
+        street = self._normalize_agent_address_part(street)
+        city = self._normalize_agent_address_part(city)
+        if not street and not city:
+            return False
+        key = '|'.join([street, self._normalize_agent_address_part(zip_code), city, str(country_id or '')])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @api.depends('type', 'street', 'zip', 'city', 'country_id')
+    def _compute_agent_address_hash(self):
+        for partner in self:
+            if partner.type == 'delivery':
+                partner.agent_address_hash = self._get_agent_address_hash(
+                    partner.street, partner.zip, partner.city, partner.country_id.id)
+            else:
+                partner.agent_address_hash = False
+
+    def _find_agent_delivery_address(self, street, zip_code, city, country_id):
+        """Indirizzo di consegna del cliente con lo stesso indirizzo normalizzato (una ricerca indicizzata)."""
+        self.ensure_one()
+        address_hash = self._get_agent_address_hash(street, zip_code, city, country_id)
+        if not address_hash:
+            return self.browse()
+        return self.search([
+            ('agent_address_hash', '=', address_hash),
+            ('parent_id', '=', self.id),
+            ('type', '=', 'delivery'),
+        ], order='id', limit=1)
+
+    @api.model
+    def _merge_agent_duplicate_addresses(self):
+        """
+        Job una tantum: unisce gli indirizzi di consegna duplicati dello stesso
+        cliente (stessa impronta) nel più vecchio, con il wizard di unione
+        contatti di Odoo che aggiorna tutti i riferimenti (ordini, fatture...).
+        Lavora a blocchi e, se restano gruppi, chiede al cron di ripartire.
+        """
+        start = time.perf_counter()
+        groups = self.sudo()._read_group(
+            [('type', '=', 'delivery'), ('agent_address_hash', '!=', False), ('parent_id', '!=', False)],
+            ['parent_id', 'agent_address_hash'],
+            ['id:array_agg'],
+            having=[('__count', '>', 1)],
+        )
+        Wizard = self.env['base.partner.merge.automatic.wizard'].sudo()
+        merged_count = 0
+        for _parent, _address_hash, partner_ids in groups[:ADDRESS_MERGE_BATCH_SIZE]:
+            partner_ids = sorted(partner_ids)
+            destination = self.sudo().browse(partner_ids[0])
+            duplicate_ids = partner_ids[1:]
+            step = ADDRESS_MERGE_WIZARD_LIMIT - 1
+            for offset in range(0, len(duplicate_ids), step):
+                chunk = duplicate_ids[offset:offset + step]
+                Wizard._merge([destination.id] + chunk, destination, extra_checks=False)
+                merged_count += len(chunk)
+
+        remaining = max(len(groups) - ADDRESS_MERGE_BATCH_SIZE, 0)
+        _logger.info(
+            '[AGENT ADDRESS] %s indirizzi duplicati uniti in %s gruppi (%s gruppi rimanenti) in %.3fs',
+            merged_count, min(len(groups), ADDRESS_MERGE_BATCH_SIZE), remaining, time.perf_counter() - start,
+        )
+        self.env['ir.cron']._notify_progress(done=min(len(groups), ADDRESS_MERGE_BATCH_SIZE), remaining=remaining)
+
     def get_agent_customers(self):
         """
         Restituisce i clienti associati all'agente corrente (utente portale).
         Un cliente è associato se ha l'agente come 'user_id' (Addetto vendite).
         Restituisce solo le aziende principali, non gli indirizzi di consegna.
+        La ricerca gira sulla replica di lettura, se configurata.
         """
         self.ensure_one()
         if not self.user_id:
             return self.env['res.partner']
 
-        # Cerca tutti i partner che hanno questo utente come venditore
-        # Filtra solo i partner principali (senza parent_id) o le aziende (is_company=True)
-        # Esclude gli indirizzi di consegna/fatturazione (parent_id != False)
-        customers = self.env['res.partner'].search([
+        customer_ids = replica_read(
+            self.env, lambda env: env['res.partner'].search(self._get_agent_customers_domain()).ids)
+        return self.env['res.partner'].browse(customer_ids)
+
+    def _get_agent_customers_domain(self):
+        """
+        Dominio dei clienti dell'agente: tutti i partner che hanno questo utente
+        come venditore, solo partner principali (esclusi gli indirizzi di
+        consegna/fatturazione) ed escluso l'agente stesso.
+        """
+        self.ensure_one()
+        return [
             ('user_id', '=', self.user_id.id),
             ('id', '!=', self.id),  # Esclude l'agente stesso
             ('parent_id', '=', False),  # Solo partner principali, non indirizzi child
-        ])
+        ]
+
+    def _get_agent_customer(self, customer_id):
+        """Cliente dell'agente con l'id dato, o recordset vuoto se non valido o non associato."""
+        self.ensure_one()
+        customer = self.env['res.partner']
+        if customer_id and self.user_id:
+            try:
+                customer = customer.search(self._get_agent_customers_domain() + [('id', '=', int(customer_id))], limit=1)
+            except (TypeError, ValueError):
+                pass
+        return customer
 
-        return customers
+    def _get_agent_customers_version(self):
+        """Timbro di versione dei clienti dell'agente: (numero clienti, ultima modifica)."""
+        self.ensure_one()
+        if not self.user_id:
+            return (0, False)
+        [(count, write_date)] = replica_read(self.env, lambda env: env['res.partner']._read_group(
+            self._get_agent_customers_domain(), [], ['__count', 'write_date:max']))
+        return (count, write_date)
 
     @api.model
     def get_customers_for_portal_user(self):
@@ -33,11 +157,11 @@ class ResPartner(models.Model):
         Helper method per ottenere i clienti dell'utente portale corrente.
         Usato nei controller.
         """
-        if self.env.user._is_public() or not self.env.user.has_group('base.group_portal'):
+        agent_context = self.env.user._get_agent_context()
+        if not agent_context.is_agent:
             return self.env['res.partner']
 
-        agent_partner = self.env.user.partner_id
-        return agent_partner.get_agent_customers()
+        return agent_context.partner.get_agent_customers()
 
     def can_agent_access_partner(self, partner_id):
         """
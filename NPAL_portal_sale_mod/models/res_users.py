@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models
+from odoo.http import request
+
+AGENT_CUSTOMER_SESSION_KEY = 'agent_selected_customer_id'
+
+
+class AgentContext(object):
+    """
+    Contesto agente dell'utente, legato all'environment del chiamante.
+    Raccoglie i dati usati da controller e modelli (gruppo portale, partner
+    agente, cliente selezionato, listino). Lo stato risolto (solo ID e
+    booleani) è condiviso per richiesta HTTP, così has_group() e la verifica
+    del cliente non si ripetono a ogni chiamata; i record vengono sempre
+    ricreati nell'environment del chiamante.
+    """
+
+    def __init__(self, user, state=None):
+        self.user = user
+        self._state = state if state is not None else self._get_state(user)
+
+    @staticmethod
+    def _get_state(user):
+        """Stato del contesto (ID e booleani), calcolato senza superutente."""
+        user = user.sudo(False)
+        assert not user.env.su
+        is_public = user._is_public()
+        return {
+            'is_public': is_public,
+            'is_agent': not is_public and user.has_group('base.group_portal'),
+            'partner_id': user.partner_id.id,
+            # (id cliente in sessione, id cliente esistente o False)
+            'customer': None,
+        }
+
+    @property
+    def is_public(self):
+        return self._state['is_public']
+
+    @property
+    def is_agent(self):
+        return self._state['is_agent']
+
+    @property
+    def partner(self):
+        """Partner dell'agente, nell'environment del chiamante."""
+        return self.user.env['res.partner'].browse(self._state['partner_id'])
+
+    @property
+    def customer_id(self):
+        """ID del cliente selezionato salvato in sessione (o False)."""
+        if not request:
+            return False
+        return request.session.get(AGENT_CUSTOMER_SESSION_KEY) or False
+
+    @property
+    def customer(self):
+        """Cliente selezionato (sudo), recordset vuoto se assente o cancellato."""
+        customer_id = self.customer_id
+        Partner = self.user.env['res.partner'].sudo()
+        cached = self._state['customer']
+        if cached is None or cached[0] != customer_id:
+            cached = (customer_id, customer_id and Partner.browse(int(customer_id)).exists().id)
+            self._state['customer'] = cached
+        return Partner.browse(cached[1] or [])
+
+    @property
+    def pricelist(self):
+        """Listino del cliente selezionato (recordset vuoto se non impostato)."""
+        return self.customer.property_product_pricelist
+
+    def select_customer(self, customer_id):
+        """
+        Salva il cliente selezionato in sessione e lo porta in cima ai clienti
+        recenti. Se il cliente cambia, il carrello in corso viene parcheggiato
+        per il cliente precedente e viene ripreso quello parcheggiato per il
+        nuovo. Restituisce il carrello ripreso (sudo) o un recordset vuoto.
+        """
+        customer_id = int(customer_id)
+        RecentCustomer = self.user.env['agent.recent.customer'].sudo()
+        restored = self.user.env['sale.order'].sudo()
+        if customer_id != self.customer_id:
+            self.park_cart()
+            restored = RecentCustomer._pop_parked_order(self.user, customer_id)
+            if restored:
+                request.website.sale_reset()
+                request.session['sale_order_id'] = restored.id
+                request.session['website_sale_cart_quantity'] = restored.cart_quantity
+        request.session[AGENT_CUSTOMER_SESSION_KEY] = customer_id
+        RecentCustomer._touch(self.user, customer_id)
+        self._state['customer'] = None
+        return restored
+
+    def park_cart(self):
+        """
+        Parcheggia il carrello in corso per il cliente selezionato (ripreso
+        quando l'agente torna sul cliente) e lo stacca dalla sessione.
+        Restituisce True se un carrello è stato parcheggiato.
+        """
+        customer = self.customer
+        website = getattr(request, 'website', None)
+        order = website.sale_get_order() if website else None
+        if not customer or not order or not order.order_line:
+            return False
+        self.user.env['agent.recent.customer'].sudo()._park_order(self.user, customer.id, order)
+        website.sale_reset()
+        return True
+
+    def clear_customer(self):
+        """Rimuove il cliente selezionato dalla sessione."""
+        if request and AGENT_CUSTOMER_SESSION_KEY in request.session:
+            del request.session[AGENT_CUSTOMER_SESSION_KEY]
+        self._state['customer'] = None
+
+    def get_recent_customers(self):
+        """Clienti recenti dell'agente (lista di dict id, name, parked)."""
+        if not self.is_agent:
+            return []
+        return self.user.env['agent.recent.customer'].sudo()._get_recent_customers(self.user, self.partner)
+
+
+class ResUsers(models.Model):
+    _inherit = 'res.users'
+
+    def _get_agent_context(self):
+        """
+        Restituisce il contesto agente dell'utente, legato all'environment del
+        chiamante (un chiamante sudo ottiene record sudo, gli altri no).
+        Durante una richiesta HTTP lo stato risolto (ID e booleani) viene
+        memorizzato sulla richiesta per utente e condiviso tra controller e
+        modelli; fuori da una richiesta (cron, shell) viene ricalcolato a ogni
+        chiamata.
+        """
+        self.ensure_one()
+        if not request:
+            return AgentContext(self)
+
+        states = getattr(request, '_npal_agent_context_states', None)
+        if states is None:
+            states = request._npal_agent_context_states = {}
+        if self.id not in states:
+            states[self.id] = AgentContext._get_state(self)
+        return AgentContext(self, states[self.id])
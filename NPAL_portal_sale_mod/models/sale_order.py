@@ -1,8 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import time
+import uuid
+from collections import defaultdict
 from datetime import timedelta
+
+from markupsafe import Markup
+
+import psycopg2
+
 from odoo import models, fields, api, _
 from odoo.exceptions import AccessError, UserError
+from odoo.tools.sql import create_index
+
+from ..tools.agent_metrics import instrument
+
+_logger = logging.getLogger(__name__)
 
 
 class SaleOrder(models.Model):
@@ -53,26 +67,73 @@ class SaleOrder(models.Model):
         help='Data e ora dell\'ultimo cambio di stato operativo'
     )
 
+    # Idempotenza dell'invio dalla pagina di finalizzazione agente
+    agent_submission_token = fields.Char(
+        string='Token Invio Agente',
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        help='Token del carrello inserito nel modulo di finalizzazione',
+    )
+
+    agent_submission_result = fields.Char(
+        string='Esito Invio Agente',
+        readonly=True,
+        copy=False,
+        help='Pagina restituita al primo invio: gli invii ripetuti con lo stesso token la riusano senza scritture',
+    )
+
+    def init(self):
+        super().init()
+        # Lista ordini agente: filtro per agente e stato, ordinamento per data
+        create_index(
+            self._cr, 'sale_order_agent_status_date_index', self._table,
+            ['created_by_agent_id', 'agent_order_status', 'date_order DESC', 'id DESC'],
+            where='created_by_agent_id IS NOT NULL',
+        )
+
     @api.depends('created_by_agent_id')
     def _compute_is_agent_order(self):
         for order in self:
             order.is_agent_order = bool(order.created_by_agent_id)
 
+    def _get_agent_submission_token(self):
+        """Token di invio del carrello, generato alla prima finalizzazione."""
+        self.ensure_one()
+        if not self.agent_submission_token:
+            self.agent_submission_token = uuid.uuid4().hex
+        return self.agent_submission_token
+
+    def _lock_agent_submission(self):
+        """
+        Blocca la riga dell'ordine per tutta la transazione di invio.
+        Restituisce False se un altro invio la sta già elaborando.
+        """
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("SELECT id FROM sale_order WHERE id = %s FOR UPDATE NOWAIT", [self.id])
+        except psycopg2.errors.LockNotAvailable:
+            return False
+        return True
+
+    @instrument('sale_order._check_agent_access')
     def _check_agent_access(self):
         """
         Verifica che l'utente portale abbia accesso a questo ordine.
         Un agente può accedere agli ordini dei clienti associati a lui.
         """
         self.ensure_one()
-        if self.env.user._is_public():
+        agent_context = self.env.user._get_agent_context()
+        if agent_context.is_public:
             raise AccessError(_("Gli utenti pubblici non possono accedere agli ordini."))
 
         # Gli utenti interni hanno sempre accesso
-        if not self.env.user.has_group('base.group_portal'):
+        if not agent_context.is_agent:
             return True
 
         # Per gli utenti portale, verifica che siano l'agente del cliente
-        partner = self.env.user.partner_id
+        partner = agent_context.partner
         if self.partner_id.user_id != self.env.user and self.partner_id.user_id != partner.user_id:
             # Verifica se il partner dell'ordine ha come venditore l'agente corrente
             if self.partner_id.user_id != partner or self.created_by_agent_id != partner:
@@ -85,7 +146,7 @@ class SaleOrder(models.Model):
         Permette agli agenti di modificare solo ordini in stato bozza.
         Traccia i cambi di stato operativo e crea task automatici.
         """
-        if self.env.user.has_group('base.group_portal'):
+        if self.env.user._get_agent_context().is_agent:
             for order in self:
                 if order.state not in ['draft', 'sent']:
                     raise UserError(_(
@@ -112,17 +173,18 @@ class SaleOrder(models.Model):
         Se un utente portale crea un ordine, salva l'agente che lo ha creato.
         Imposta automaticamente lo stato operativo se non specificato.
         """
+        agent_context = self.env.user._get_agent_context()
         for vals in vals_list:
             # Se è un utente portale, salva l'agente
-            if self.env.user.has_group('base.group_portal') and not self.env.user._is_public():
-                vals['created_by_agent_id'] = self.env.user.partner_id.id
+            if agent_context.is_agent:
+                vals['created_by_agent_id'] = agent_context.partner.id
 
             # Imposta lo stato operativo automaticamente se non già impostato
             if 'agent_order_status' not in vals or not vals.get('agent_order_status'):
                 # Se creato da agente portale, lo stato dipende dal tipo di ordine
                 # Verrà impostato nei controller specifici
                 # Altrimenti default a 'quotation' per ordini interni
-                if not self.env.user.has_group('base.group_portal'):
+                if not agent_context.is_agent:
                     vals['agent_order_status'] = 'quotation'
 
             # Imposta la data di cambio stato
@@ -142,29 +204,27 @@ class SaleOrder(models.Model):
         """
         Gli utenti portale non possono confermare ordini.
         """
-        if self.env.user.has_group('base.group_portal'):
+        if self.env.user._get_agent_context().is_agent:
             raise UserError(_("Gli agenti non possono confermare gli ordini. Contatta il back office."))
 
-        return super(SaleOrder, self).action_confirm()
+        result = super(SaleOrder, self).action_confirm()
+        # Aggiorna i prodotti frequenti dei clienti con gli ordini appena confermati
+        self.env['agent.customer.product'].sudo()._update_from_orders(self.filtered(lambda order: order.state == 'sale'))
+        return result
 
+    @instrument('sale_order._create_agent_order_confirmation_task')
     def _create_agent_order_confirmation_task(self):
         """
         Crea un'attività (mail.activity) per confermare un ordine arrivato da un agente.
         L'attività appare nel chatter dell'ordine.
         """
         self.ensure_one()
-
-        import logging
-        _logger = logging.getLogger(__name__)
-
-        _logger.info(f'[AGENT ORDER] Tentativo creazione attività per ordine {self.name}')
+        start = time.perf_counter()
 
         # Ottieni gli utenti configurati per ricevere le attività
         config = self.env['ir.config_parameter'].sudo()
         user_ids_str = config.get_param('NPAL_portal_sale_mod.task_confirmation_user_ids', '')
 
-        _logger.info(f'[AGENT ORDER] Utenti configurati: {user_ids_str}')
-
         if not user_ids_str:
             # Se non ci sono utenti configurati, skip
             _logger.warning('[AGENT ORDER] Nessun utente configurato per attività conferma ordini!')
@@ -173,15 +233,13 @@ class SaleOrder(models.Model):
         try:
             user_ids = [int(uid) for uid in user_ids_str.split(',') if uid.strip()]
         except (ValueError, AttributeError) as e:
-            _logger.error(f'[AGENT ORDER] Errore parsing user_ids: {e}')
+            _logger.error('[AGENT ORDER] Errore parsing user_ids: %s', e)
             return
 
         if not user_ids:
             _logger.warning('[AGENT ORDER] Lista user_ids vuota dopo parsing')
             return
 
-        _logger.info(f'[AGENT ORDER] Creazione attività per utenti: {user_ids}')
-
         # Ottieni il tipo di attività "Da fare" (TODO)
         activity_type = self.env.ref('mail.mail_activity_data_todo', raise_if_not_found=False)
         if not activity_type:
@@ -191,8 +249,16 @@ class SaleOrder(models.Model):
         # Ottieni l'ID del modello sale.order
         model_id = self.env['ir.model']._get('sale.order').id
 
+        # Prenota le attività del giorno: create e write concorrenti non le duplicano
+        period = fields.Date.to_string(fields.Date.today())
+        claimed = self.env['agent.order.activity'].sudo()._claim(
+            'confirmation', [(self.id, user_id, period) for user_id in user_ids])
+
         # Crea un'attività per ogni utente configurato
+        created_count = 0
         for user_id in user_ids:
+            if (self.id, user_id) not in claimed:
+                continue
             activity_vals = {
                 'res_model_id': model_id,
                 'res_id': self.id,
@@ -212,25 +278,41 @@ class SaleOrder(models.Model):
             }
 
             try:
-                activity = self.env['mail.activity'].sudo().create(activity_vals)
-                _logger.info(f'[AGENT ORDER] Attività creata con successo! ID: {activity.id}, Utente: {user_id}')
+                with self.env.cr.savepoint():
+                    activity = self.env['mail.activity'].sudo().create(activity_vals)
+                created_count += 1
+                _logger.debug('[AGENT ORDER] Attività %s creata per ordine %s, utente %s', activity.id, self.name, user_id)
             except Exception as e:
-                _logger.error(f'[AGENT ORDER] Errore creazione attività per utente {user_id}: {e}', exc_info=True)
+                _logger.error('[AGENT ORDER] Errore creazione attività per ordine %s, utente %s: %s', self.name, user_id, e, exc_info=True)
+                # Prenotazione annullata: l'attività verrà ritentata alla prossima scrittura
+                self.env['agent.order.activity'].sudo()._release('confirmation', [(self.id, user_id, period)])
+
+        _logger.info(
+            '[AGENT ORDER] Ordine %s: %s/%s attività di conferma create in %.3fs',
+            self.name, created_count, len(user_ids), time.perf_counter() - start,
+        )
+
+    @api.model
+    def _get_stale_period(self, order, now, days_limit):
+        """Periodo di fermo dell'ordine: cambio di stato e numero di intervalli di N giorni trascorsi."""
+        days_stuck = (now - order.agent_status_date).days
+        return '%s/%s' % (fields.Datetime.to_string(order.agent_status_date), days_stuck // max(days_limit, 1))
 
     @api.model
+    @instrument('sale_order._check_stale_orders_and_create_tasks')
     def _check_stale_orders_and_create_tasks(self):
         """
         Cron job che controlla ordini fermi nello stesso stato da troppo tempo.
         Crea attività (mail.activity) che appaiono nel chatter degli ordini.
         Chiamato automaticamente da scheduled action.
         """
-        import logging
-        _logger = logging.getLogger(__name__)
+        start = time.perf_counter()
 
         # Ottieni configurazione giorni di attesa
         config = self.env['ir.config_parameter'].sudo()
         days_limit = int(config.get_param('NPAL_portal_sale_mod.stale_order_days', '7'))
         user_ids_str = config.get_param('NPAL_portal_sale_mod.task_stale_user_ids', '')
+        digest_mode = bool(config.get_param('NPAL_portal_sale_mod.stale_digest_mode'))
 
         if not user_ids_str:
             return
@@ -262,28 +344,39 @@ class SaleOrder(models.Model):
             ('state', 'not in', ['cancel', 'done']),
         ])
 
-        # Per ogni ordine fermo, controlla se esiste già un'attività recente
+        # Una segnalazione per ogni periodo di N giorni di fermo nello stesso stato:
+        # la prenotazione è atomica anche con più worker del cron in parallelo
+        now = fields.Datetime.now()
+        ActivityClaim = self.env['agent.order.activity'].sudo()
+        ActivityClaim._gc_claims()
+        claimed = ActivityClaim._claim('stale', [
+            (order.id, user_id, self._get_stale_period(order, now, days_limit))
+            for order in stale_orders for user_id in user_ids
+        ])
+
+        created_count = skipped_count = error_count = 0
+        digest_orders = defaultdict(list)
         for order in stale_orders:
-            # Cerca attività già create negli ultimi N giorni per questo ordine
-            existing_activity = self.env['mail.activity'].sudo().search([
-                ('res_model', '=', 'sale.order'),
-                ('res_id', '=', order.id),
-                ('summary', 'ilike', f'Ordine fermo'),
-                ('create_date', '>=', limit_date),
-            ], limit=1)
-
-            if existing_activity:
-                # Attività già creata di recente, skip
+            order_user_ids = [user_id for user_id in user_ids if (order.id, user_id) in claimed]
+            if not order_user_ids:
+                # Attività già creata per questo periodo, skip
+                skipped_count += 1
+                continue
+
+            # Modalità riepilogo: un solo messaggio per utente a fine ciclo
+            if digest_mode:
+                for user_id in order_user_ids:
+                    digest_orders[user_id].append(order)
                 continue
 
             # Calcola giorni di fermo
-            days_stuck = (fields.Datetime.now() - order.agent_status_date).days
+            days_stuck = (now - order.agent_status_date).days
 
             # Ottieni la label dello stato
             status_label = dict(order._fields['agent_order_status'].selection).get(order.agent_order_status, order.agent_order_status)
 
             # Crea un'attività per ogni utente configurato
-            for user_id in user_ids:
+            for user_id in order_user_ids:
                 activity_vals = {
                     'res_model_id': model_id,
                     'res_id': order.id,
@@ -303,7 +396,66 @@ class SaleOrder(models.Model):
                 }
 
                 try:
-                    activity = self.env['mail.activity'].sudo().create(activity_vals)
-                    _logger.info(f'[AGENT ORDER] Attività ordine fermo creata! ID: {activity.id}, Ordine: {order.name}, Utente: {user_id}')
+                    with self.env.cr.savepoint():
+                        activity = self.env['mail.activity'].sudo().create(activity_vals)
+                    created_count += 1
+                    _logger.debug('[AGENT ORDER] Attività ordine fermo %s creata per ordine %s, utente %s', activity.id, order.name, user_id)
                 except Exception as e:
-                    _logger.error(f'[AGENT ORDER] Errore creazione attività ordine fermo per {order.name}, utente {user_id}: {e}', exc_info=True)
+                    error_count += 1
+                    _logger.error('[AGENT ORDER] Errore creazione attività ordine fermo per %s, utente %s: %s', order.name, user_id, e, exc_info=True)
+                    # Prenotazione annullata: l'attività verrà ritentata al prossimo giro del cron
+                    ActivityClaim._release('stale', [(order.id, user_id, self._get_stale_period(order, now, days_limit))])
+
+        for user_id, orders in digest_orders.items():
+            try:
+                with self.env.cr.savepoint():
+                    self._send_stale_orders_digest(self.env['res.users'].browse(user_id), orders, now)
+                created_count += 1
+            except Exception as e:
+                error_count += 1
+                _logger.error('[AGENT ORDER] Errore invio riepilogo ordini fermi a utente %s: %s', user_id, e, exc_info=True)
+                ActivityClaim._release('stale', [
+                    (order.id, user_id, self._get_stale_period(order, now, days_limit)) for order in orders
+                ])
+
+        _logger.info(
+            '[AGENT ORDER] Controllo ordini fermi: %s ordini fermi, %s già segnalati, %s %s, %s errori in %.3fs',
+            len(stale_orders), skipped_count, created_count,
+            'riepiloghi inviati' if digest_mode else 'attività create',
+            error_count, time.perf_counter() - start,
+        )
+
+    @api.model
+    def _send_stale_orders_digest(self, user, orders, now):
+        """
+        Invia all'utente un unico messaggio (Posta in arrivo o email secondo le sue
+        preferenze) con gli ordini fermi raggruppati per stato operativo.
+        """
+        status_labels = dict(self._fields['agent_order_status'].selection)
+        orders_by_status = defaultdict(list)
+        for order in orders:
+            orders_by_status[order.agent_order_status].append(order)
+
+        body = Markup('<p>%s</p>') % _("%s ordini fermi da verificare.", len(orders))
+        for status in status_labels:
+            if status not in orders_by_status:
+                continue
+            status_orders = sorted(orders_by_status[status], key=lambda order: order.agent_status_date)
+            items = Markup('').join(
+                Markup('<li><a href="/web#model=sale.order&amp;id=%s&amp;view_type=form">%s</a> - %s: fermo da %s giorni (dal %s)</li>') % (
+                    order.id,
+                    order.name,
+                    order.partner_id.name,
+                    (now - order.agent_status_date).days,
+                    order.agent_status_date.strftime('%d/%m/%Y'),
+                )
+                for order in status_orders
+            )
+            body += Markup('<p><strong>%s</strong> (%s)</p><ul>%s</ul>') % (status_labels[status], len(status_orders), items)
+
+        self.env['mail.thread'].sudo().message_notify(
+            partner_ids=user.partner_id.ids,
+            subject=_("Riepilogo ordini fermi: %s", len(orders)),
+            body=body,
+        )
+        _logger.debug('[AGENT ORDER] Riepilogo di %s ordini fermi inviato a utente %s', len(orders), user.id)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models
+
+
+class SaleOrderLine(models.Model):
+    _inherit = 'sale.order.line'
+
+    def _get_pricelist_price(self):
+        """
+        Legge il prezzo dalla tabella prezzi precalcolata del listino quando la
+        riga usa l'UdM del prodotto, la valuta del listino, l'ordine è di oggi
+        e il prodotto non è coperto da regole a date (solo portale agenti).
+        """
+        self.ensure_one()
+        pricelist = self.order_id.pricelist_id
+        if (
+            pricelist
+            and self.product_id
+            and not self.product_no_variant_attribute_value_ids
+            and pricelist._can_use_agent_price_table(
+                self.product_id,
+                currency=self.currency_id,
+                date=self.order_id.date_order,
+                uom=self.product_uom,
+            )
+        ):
+            dated_ids = pricelist._get_agent_price_table_dated_product_ids()
+            if dated_ids is None or self.product_id.id in dated_ids:
+                return super()._get_pricelist_price()
+            prices = self.env['agent.pricelist.price'].sudo()._lookup(
+                pricelist, self.product_id, self.product_uom_qty or 1.0)
+            if self.product_id.id in prices:
+                return prices[self.product_id.id][0]
+        return super()._get_pricelist_price()
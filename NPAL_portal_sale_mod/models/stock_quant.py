@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+# Campi delle quant da cui dipende la tabella disponibilità agenti
+AGENT_STOCK_QUANT_FIELDS = {'product_id', 'location_id', 'quantity', 'reserved_quantity'}
+
+
+class StockQuant(models.Model):
+    _inherit = 'stock.quant'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super().create(vals_list)
+        self.env['agent.stock.availability']._mark_products(quants.product_id.ids)
+        return quants
+
+    def write(self, vals):
+        if not AGENT_STOCK_QUANT_FIELDS & set(vals):
+            return super().write(vals)
+        product_ids = set(self.product_id.ids)
+        result = super().write(vals)
+        product_ids.update(self.product_id.ids)
+        self.env['agent.stock.availability']._mark_products(product_ids)
+        return result
+
+    def unlink(self):
+        product_ids = self.product_id.ids
+        result = super().unlink()
+        self.env['agent.stock.availability']._mark_products(product_ids)
+        return result
@@ -0,0 +1,162 @@
+/** @odoo-module **/
+
+import { _t } from "@web/core/l10n/translation";
+import publicWidget from "@web/legacy/js/public/public_widget";
+
+/**
+ * Verifica disponibilità per magazzino nella scheda prodotto (solo agenti).
+ * Elenco magazzini e disponibilità vengono richiesti solo quando il riquadro
+ * entra nella parte visibile della pagina; le risposte GET con ETag sono
+ * rivalidate dal browser (304).
+ */
+publicWidget.registry.AgentStockInfo = publicWidget.Widget.extend({
+    selector: '.o_agent_stock_info',
+    events: {
+        'change #warehouse_stock_selector': '_onChangeWarehouse',
+    },
+
+    /**
+     * @override
+     */
+    start: function () {
+        this.warehouseSelector = this.el.querySelector('#warehouse_stock_selector');
+        this.resultEl = this.el.querySelector('.o_agent_stock_result');
+        this.form = this.el.closest('form');
+        this.loaded = false;
+        this.requestId = 0;
+
+        // Cambio variante: website_sale aggiorna product_id e lancia 'change'
+        // con jQuery (non visibile ad addEventListener), quindi delega jQuery
+        this._onChangeProduct = this._onChangeProduct.bind(this);
+        this.productInput = this.form && this.form.querySelector('input[name="product_id"]');
+        if (this.form) {
+            $(this.form).on('change.agentStockInfo', 'input[name="product_id"]', this._onChangeProduct);
+        }
+
+        if ('IntersectionObserver' in window) {
+            this.observer = new IntersectionObserver((entries) => {
+                if (entries.some((entry) => entry.isIntersecting)) {
+                    this._stopObserving();
+                    this._loadWarehouses();
+                }
+            }, { rootMargin: '200px' });
+            this.observer.observe(this.el);
+        } else {
+            this._loadWarehouses();
+        }
+        return this._super.apply(this, arguments);
+    },
+
+    /**
+     * @override
+     */
+    destroy: function () {
+        this._stopObserving();
+        if (this.form) {
+            $(this.form).off('.agentStockInfo');
+        }
+        this._super.apply(this, arguments);
+    },
+
+    //--------------------------------------------------------------------------
+    // Private
+    //--------------------------------------------------------------------------
+
+    _stopObserving: function () {
+        if (this.observer) {
+            this.observer.disconnect();
+            this.observer = null;
+        }
+    },
+
+    /**
+     * GET JSON con i cookie di sessione; il browser gestisce If-None-Match.
+     * @private
+     */
+    _fetchJson: async function (url) {
+        const response = await fetch(url, { credentials: 'same-origin', headers: { Accept: 'application/json' } });
+        if (!response.ok) {
+            throw new Error(_t("Errore di connessione (HTTP %s)", response.status));
+        }
+        return response.json();
+    },
+
+    _loadWarehouses: async function () {
+        this._setResult('alert-info', 'fa-spinner fa-spin', _t("Caricamento..."));
+        let data;
+        try {
+            data = await this._fetchJson('/shop/agent/warehouses');
+        } catch (error) {
+            this._setResult('alert-danger', 'fa-times-circle', error.message);
+            return;
+        }
+        for (const [warehouseId, name] of data.warehouses || []) {
+            const option = document.createElement('option');
+            option.value = warehouseId;
+            option.textContent = name;
+            this.warehouseSelector.appendChild(option);
+        }
+        this.warehouseSelector.disabled = false;
+        this.loaded = true;
+
+        // Con un solo magazzino la disponibilità viene mostrata subito
+        if ((data.warehouses || []).length === 1) {
+            this.warehouseSelector.value = data.warehouses[0][0];
+        }
+        this._updateStock();
+    },
+
+    _updateStock: async function () {
+        const warehouseId = parseInt(this.warehouseSelector.value);
+        const productId = this.productInput ? parseInt(this.productInput.value) : NaN;
+        if (!this.loaded || !warehouseId || !productId) {
+            this._setResult('alert-info', 'fa-info-circle', _t("Seleziona un magazzino"));
+            return;
+        }
+
+        // Solo l'ultima richiesta aggiorna il riquadro (cambi rapidi di variante o magazzino)
+        const requestId = ++this.requestId;
+        this._setResult('alert-info', 'fa-spinner fa-spin', _t("Caricamento..."));
+        let data;
+        try {
+            data = await this._fetchJson(`/shop/product/stock/${productId}/${warehouseId}`);
+        } catch (error) {
+            data = { error: error.message };
+        }
+        if (requestId !== this.requestId) {
+            return;
+        }
+
+        if (data.qty_available !== undefined) {
+            const qty = parseFloat(data.qty_available);
+            this._setResult(
+                qty > 0 ? 'alert-success' : 'alert-warning',
+                qty > 0 ? 'fa-check-circle' : 'fa-exclamation-triangle',
+                `${qty.toFixed(2)} ${data.uom_name || _t("unità")}`
+            );
+        } else {
+            this._setResult('alert-danger', 'fa-times-circle', data.error || _t("Errore nel recupero dati"));
+        }
+    },
+
+    _setResult: function (alertClass, icon, text) {
+        const iconEl = document.createElement('i');
+        iconEl.className = `fa ${icon}`;
+        this.resultEl.className = `o_agent_stock_result alert ${alertClass} mb-0 py-2`;
+        this.resultEl.replaceChildren(iconEl, document.createTextNode(` ${text}`));
+    },
+
+    //--------------------------------------------------------------------------
+    // Handlers
+    //--------------------------------------------------------------------------
+
+    _onChangeWarehouse: function () {
+        this._updateStock();
+    },
+
+    _onChangeProduct: function () {
+        this._updateStock();
+    },
+});
+
+export default publicWidget.registry.AgentStockInfo;
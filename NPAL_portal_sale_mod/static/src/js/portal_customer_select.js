@@ -30,6 +30,101 @@ publicWidget.registry.PortalCustomerSelect = publicWidget.Widget.extend({
 
 export default publicWidget.registry.PortalCustomerSelect;
 
+/**
+ * Menu clienti recenti nella barra del cliente selezionato: l'elenco viene
+ * richiesto solo alla prima apertura del menu, così le pagine del negozio non
+ * lo calcolano (né lo includono nella loro cache).
+ */
+publicWidget.registry.AgentRecentCustomers = publicWidget.Widget.extend({
+    selector: '.o_agent_recent_customers',
+    events: {
+        'show.bs.dropdown': '_onShowDropdown',
+    },
+
+    /**
+     * @override
+     */
+    start: function () {
+        this.listEl = this.el.querySelector('.o_agent_recent_customers_list');
+        this.loaded = false;
+        return this._super.apply(this, arguments);
+    },
+
+    //--------------------------------------------------------------------------
+    // Private
+    //--------------------------------------------------------------------------
+
+    _loadRecentCustomers: async function () {
+        let data;
+        try {
+            const response = await fetch('/my/orders/recent_customers', {
+                credentials: 'same-origin',
+                headers: { Accept: 'application/json' },
+            });
+            data = response.ok ? await response.json() : {};
+        } catch {
+            data = {};
+        }
+        if (!data.customers) {
+            this.loaded = false;
+            this._setMessage(_t("Errore nel caricamento dei clienti recenti"));
+            return;
+        }
+        if (!data.customers.length) {
+            this._setMessage(_t("Nessun cliente recente"));
+            return;
+        }
+        this.listEl.replaceChildren(...data.customers.map((customer) => this._renderCustomer(customer)));
+    },
+
+    /**
+     * Un form POST per cliente (/my/orders/switch_customer, con token CSRF).
+     * @private
+     */
+    _renderCustomer: function (customer) {
+        const form = document.createElement('form');
+        form.action = '/my/orders/switch_customer';
+        form.method = 'post';
+        for (const [name, value] of [['csrf_token', odoo.csrf_token], ['customer_id', customer.id]]) {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = name;
+            input.value = value;
+            form.appendChild(input);
+        }
+        const button = document.createElement('button');
+        button.type = 'submit';
+        button.className = 'dropdown-item';
+        button.textContent = customer.name;
+        if (customer.parked) {
+            const icon = document.createElement('i');
+            icon.className = 'fa fa-shopping-cart ms-1';
+            icon.title = _t("Carrello in sospeso");
+            button.appendChild(icon);
+        }
+        form.appendChild(button);
+        return form;
+    },
+
+    _setMessage: function (text) {
+        const message = document.createElement('span');
+        message.className = 'dropdown-item-text text-muted';
+        message.textContent = text;
+        this.listEl.replaceChildren(message);
+    },
+
+    //--------------------------------------------------------------------------
+    // Handlers
+    //--------------------------------------------------------------------------
+
+    _onShowDropdown: function () {
+        if (!this.loaded) {
+            this.loaded = true;
+            this._loadRecentCustomers();
+        }
+    },
+});
+
 /**
  * Global function to clear customer selection
  * Called from the indicator bar
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from . import test_agent_portal_benchmark
+from . import test_agent_price_table
+from . import test_http_cache
+from . import test_read_replica
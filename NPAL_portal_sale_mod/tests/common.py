@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from odoo import fields, http, release
+from odoo.tests import HttpCase
+
+from ..models.res_users import AGENT_CUSTOMER_SESSION_KEY
+
+_logger = logging.getLogger(__name__)
+
+# Volumi di riferimento del dataset sintetico (moltiplicati per NPAL_BENCHMARK_SCALE)
+BENCHMARK_AGENTS = 50
+BENCHMARK_CUSTOMERS_PER_AGENT = 5000
+BENCHMARK_PRODUCTS = 20000
+BENCHMARK_ORDERS = 100000
+
+BENCHMARK_BATCH_SIZE = 1000
+BENCHMARK_STALE_RATIO = 0.1
+
+
+class AgentPortalBenchmarkCase(HttpCase):
+    """
+    Base per i benchmark del portale agenti.
+    Crea un dataset sintetico (agenti, clienti, prodotti, ordini) e misura
+    numero di query e tempo per ogni flusso; i risultati vengono scritti in
+    JSON a fine classe per confrontarli tra una release e l'altra.
+
+    Variabili d'ambiente:
+    * NPAL_BENCHMARK_SCALE: fattore di scala dei volumi (default 1.0)
+    * NPAL_BENCHMARK_ROUNDS: ripetizioni per flusso (default 3)
+    * NPAL_BENCHMARK_OUTPUT: percorso del file JSON dei risultati
+    * NPAL_BENCHMARK_CALIBRATE: se impostata i budget di query non vengono
+      verificati; il JSON riporta le query misurate da cui ricavarli
+
+    Le sottoclassi possono fissare scala e ripetizioni (benchmark_scale,
+    benchmark_rounds), ignorando le variabili d'ambiente, e un suffisso per
+    il file dei risultati (benchmark_output_suffix).
+    """
+
+    benchmark_scale = None
+    benchmark_rounds = None
+    benchmark_output_suffix = ''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.scale = cls.benchmark_scale or float(os.environ.get('NPAL_BENCHMARK_SCALE', '1.0'))
+        cls.rounds = cls.benchmark_rounds or max(1, int(os.environ.get('NPAL_BENCHMARK_ROUNDS', '3')))
+        cls.calibrate = bool(os.environ.get('NPAL_BENCHMARK_CALIBRATE'))
+        output_root, output_ext = os.path.splitext(os.environ.get('NPAL_BENCHMARK_OUTPUT') or os.path.join(
+            tempfile.gettempdir(), 'npal_portal_benchmark.json'))
+        cls.output_path = output_root + cls.benchmark_output_suffix + output_ext
+        cls.results = {}
+
+        start = time.perf_counter()
+        cls._seed_benchmark_data()
+        cls.seed_duration = time.perf_counter() - start
+        _logger.info('Dataset benchmark creato in %.1fs (scala %s)', cls.seed_duration, cls.scale)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._write_benchmark_results()
+        super().tearDownClass()
+
+    @classmethod
+    def _scaled(cls, value):
+        return max(1, int(value * cls.scale))
+
+    @classmethod
+    def _create_in_batches(cls, env, model, vals_list):
+        """Crea i record a blocchi e restituisce il recordset risultante."""
+        ids = []
+        for start in range(0, len(vals_list), BENCHMARK_BATCH_SIZE):
+            ids.extend(env[model].create(vals_list[start:start + BENCHMARK_BATCH_SIZE]).ids)
+        return env[model].browse(ids)
+
+    @classmethod
+    def _seed_benchmark_data(cls):
+        env = cls.env(context=dict(
+            cls.env.context,
+            tracking_disable=True,
+            mail_create_nolog=True,
+            mail_notrack=True,
+            no_reset_password=True,
+        ))
+        portal_group = env.ref('base.group_portal')
+
+        agent_count = cls._scaled(BENCHMARK_AGENTS)
+        cls.agent_users = cls._create_in_batches(env, 'res.users', [{
+            'name': 'Agente Benchmark %s' % index,
+            'login': 'npal_bench_agent_%s' % index,
+            'password': 'npal_bench_agent_%s' % index,
+            'groups_id': [(6, 0, [portal_group.id])],
+        } for index in range(agent_count)])
+        # I clienti dell'agente sono i partner con lo stesso venditore del partner agente
+        env.cr.execute("""
+            UPDATE res_partner p SET user_id = u.id
+              FROM res_users u
+             WHERE u.partner_id = p.id AND u.id IN %s
+        """, [tuple(cls.agent_users.ids)])
+        env.invalidate_all()
+
+        customers_per_agent = cls._scaled(BENCHMARK_CUSTOMERS_PER_AGENT)
+        cls.customers = cls._create_in_batches(env, 'res.partner', [{
+            'name': 'Cliente Benchmark %s-%s' % (agent.id, index),
+            'email': 'cliente_%s_%s@example.com' % (agent.id, index),
+            'city': 'Padova',
+            'user_id': agent.id,
+        } for agent in cls.agent_users for index in range(customers_per_agent)])
+
+        cls.products = cls._create_in_batches(env, 'product.product', [{
+            'name': 'Prodotto Benchmark %s' % index,
+            'default_code': 'BENCH%06d' % index,
+            'list_price': 10.0 + index % 100,
+            'sale_ok': True,
+            'is_published': True,
+        } for index in range(cls._scaled(BENCHMARK_PRODUCTS))])
+
+        statuses = ['quotation', 'in_production', 'ready_warehouse', 'ready_pickup',
+                    'ready_delivery', 'completed', 'waiting_info', 'supplier_order']
+        order_count = cls._scaled(BENCHMARK_ORDERS)
+        cls.orders = cls._create_in_batches(env, 'sale.order', [{
+            'partner_id': cls.customers[index % len(cls.customers)].id,
+            'created_by_agent_id': cls.customers[index % len(cls.customers)].user_id.partner_id.id,
+            'agent_order_status': statuses[index % len(statuses)],
+            'order_line': [(0, 0, {
+                'product_id': cls.products[index % len(cls.products)].id,
+                'product_uom_qty': 1 + index % 10,
+            })],
+        } for index in range(order_count)])
+
+        # Porta indietro la data di cambio stato di una parte degli ordini per il cron
+        stale_ids = tuple(cls.orders.ids[:max(1, int(order_count * BENCHMARK_STALE_RATIO))])
+        env.cr.execute(
+            "UPDATE sale_order SET agent_status_date = %s WHERE id IN %s",
+            [fields.Datetime.now() - timedelta(days=30), stale_ids],
+        )
+        env.invalidate_all()
+
+        cls.agent_user = cls.agent_users[0]
+        cls.agent_customer = cls.customers[0]
+        cls.warehouse = env['stock.warehouse'].search([], limit=1) if 'stock.warehouse' in env else False
+
+    def _authenticate_agent(self):
+        self.authenticate(self.agent_user.login, self.agent_user.login)
+
+    def _select_agent_customer(self):
+        self.url_open('/my/orders/new?customer_id=%s' % self.agent_customer.id)
+        session = http.root.session_store.get(self.session.sid)
+        self.assertEqual(session.get(AGENT_CUSTOMER_SESSION_KEY), self.agent_customer.id,
+                         "Il cliente dell'agente deve risultare selezionato in sessione")
+
+    def _fill_agent_cart(self, line_count=20):
+        for product in self.products[:line_count]:
+            self.make_jsonrpc_request('/shop/cart/update_json', {
+                'product_id': product.id,
+                'add_qty': 1,
+            })
+        session = http.root.session_store.get(self.session.sid)
+        order = self.env['sale.order'].browse(session.get('sale_order_id'))
+        self.assertTrue(order.exists() and order.order_line,
+                        "Il carrello dell'agente deve contenere righe prima della misura")
+
+    def _get_submission_token(self):
+        """Apre la finalizzazione e restituisce il token di invio del carrello dell'agente."""
+        self.url_open('/shop/agent/cart/finalize')
+        order = self.env['sale.order'].search([
+            ('partner_id', '=', self.agent_customer.id),
+            ('agent_submission_token', '!=', False),
+        ], order='id desc', limit=1)
+        return order.agent_submission_token
+
+    def _measure(self, name, func, query_budget=None, rounds=None):
+        """
+        Esegue il flusso `rounds` volte e registra query e tempi.
+        Se è indicato un budget, l'ultima esecuzione è verificata con
+        assertQueryCount (non in calibrazione).
+        """
+        rounds = rounds or self.rounds
+        durations = []
+        query_counts = []
+        for index in range(rounds):
+            self.env.flush_all()
+            self.env.invalidate_all()
+            queries_before = self.cr.sql_log_count
+            start = time.perf_counter()
+            if query_budget is not None and not self.calibrate and index == rounds - 1:
+                with self.assertQueryCount(query_budget):
+                    func()
+            else:
+                func()
+            durations.append(time.perf_counter() - start)
+            query_counts.append(self.cr.sql_log_count - queries_before)
+
+        self.results[name] = {
+            'rounds': rounds,
+            'queries': query_counts,
+            'query_budget': query_budget,
+            'wall_time_min': min(durations),
+            'wall_time_median': statistics.median(durations),
+            'wall_time_max': max(durations),
+        }
+        _logger.info('Benchmark %s: %s query, mediana %.3fs', name, query_counts[-1], statistics.median(durations))
+
+    @classmethod
+    def _write_benchmark_results(cls):
+        report = {
+            'odoo_version': release.version,
+            'date': fields.Datetime.to_string(fields.Datetime.now()),
+            'scale': cls.scale,
+            'calibrate': cls.calibrate,
+            'seed_duration': cls.seed_duration,
+            'dataset': {
+                'agents': len(cls.agent_users),
+                'customers': len(cls.customers),
+                'products': len(cls.products),
+                'orders': len(cls.orders),
+            },
+            'results': cls.results,
+        }
+        with open(cls.output_path, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        _logger.info('Risultati benchmark scritti in %s', cls.output_path)
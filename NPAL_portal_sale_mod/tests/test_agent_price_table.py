@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from ..models.product_pricelist import AGENT_PRICE_TABLE_CONTEXT_KEY
+
+
+@tagged('post_install', '-at_install')
+class TestAgentPriceTable(TransactionCase):
+    """I prezzi letti dalla tabella precalcolata coincidono con il calcolo delle regole."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.product_a, cls.product_b = cls.env['product.product'].create([
+            {'name': 'Prodotto Tabella A', 'list_price': 100.0, 'sale_ok': True},
+            {'name': 'Prodotto Tabella B', 'list_price': 50.0, 'sale_ok': True},
+        ])
+        today = fields.Date.today()
+        cls.pricelist = cls.env['product.pricelist'].create({
+            'name': 'Listino Tabella Agenti',
+            'agent_price_table': True,
+            'item_ids': [
+                (0, 0, {'applied_on': '3_global', 'compute_price': 'percentage', 'percent_price': 10.0}),
+                (0, 0, {'applied_on': '0_product_variant', 'product_id': cls.product_a.id,
+                        'min_quantity': 10.0, 'compute_price': 'fixed', 'fixed_price': 80.0}),
+                (0, 0, {'applied_on': '0_product_variant', 'product_id': cls.product_b.id,
+                        'compute_price': 'fixed', 'fixed_price': 40.0,
+                        'date_start': today - timedelta(days=1), 'date_end': today + timedelta(days=1)}),
+            ],
+        })
+        cls.env['agent.pricelist.price']._refresh(cls.pricelist)
+        cls.products = cls.product_a | cls.product_b
+
+    def _table_prices(self, products, quantity):
+        pricelist = self.pricelist.with_context(**{AGENT_PRICE_TABLE_CONTEXT_KEY: True})
+        return {product_id: price for product_id, (price, _rule) in
+                pricelist._compute_price_rule(products.with_env(pricelist.env), quantity).items()}
+
+    def _rule_prices(self, products, quantity):
+        pricelist = self.pricelist.with_context(agent_price_table_bypass=True)
+        return {product_id: price for product_id, (price, _rule) in
+                pricelist._compute_price_rule(products.with_env(pricelist.env), quantity).items()}
+
+    def _set_table_price(self, product, price):
+        self.env.cr.execute(
+            "UPDATE agent_pricelist_price SET price = %s WHERE pricelist_id = %s AND product_id = %s",
+            [price, self.pricelist.id, product.id],
+        )
+
+    def test_table_matches_rules(self):
+        self.assertFalse(self.pricelist.agent_price_table_dirty)
+        for quantity in (1.0, 10.0, 25.0):
+            table = self._table_prices(self.products, quantity)
+            rules = self._rule_prices(self.products, quantity)
+            for product in self.products:
+                self.assertAlmostEqual(table[product.id], rules[product.id], places=2)
+
+    def test_table_only_for_agent_requests(self):
+        self._set_table_price(self.product_a, 1.0)
+        prices = {product_id: price for product_id, (price, _rule) in
+                  self.pricelist._compute_price_rule(self.product_a, 1.0).items()}
+        self.assertAlmostEqual(prices[self.product_a.id], 90.0, places=2)
+        self.assertAlmostEqual(self._table_prices(self.product_a, 1.0)[self.product_a.id], 1.0, places=2)
+
+    def test_dated_rule_products_use_rules(self):
+        self._set_table_price(self.product_b, 1.0)
+        self.assertAlmostEqual(self._table_prices(self.product_b, 1.0)[self.product_b.id], 40.0, places=2)
+
+    def test_variant_price_extra_refreshes_table(self):
+        attribute = self.env['product.attribute'].create({
+            'name': 'Finitura Tabella',
+            'value_ids': [(0, 0, {'name': 'Opaca'}), (0, 0, {'name': 'Lucida'})],
+        })
+        template = self.env['product.template'].create({
+            'name': 'Prodotto Tabella Varianti',
+            'list_price': 20.0,
+            'attribute_line_ids': [(0, 0, {
+                'attribute_id': attribute.id,
+                'value_ids': [(6, 0, attribute.value_ids.ids)],
+            })],
+        })
+        variants = template.product_variant_ids
+        self.env['agent.pricelist.price']._refresh(self.pricelist, variants)
+
+        template.attribute_line_ids.product_template_value_ids[0].price_extra = 5.0
+        table = self._table_prices(variants, 1.0)
+        rules = self._rule_prices(variants, 1.0)
+        for variant in variants:
+            self.assertAlmostEqual(table[variant.id], rules[variant.id], places=2)
+
+    def test_dated_product_ids_cached(self):
+        self.assertEqual(self.pricelist._get_agent_price_table_dated_product_ids(), {self.product_b.id})
+        with self.assertQueryCount(0):
+            self.pricelist._get_agent_price_table_dated_product_ids()
+
+        today = fields.Date.today()
+        self.pricelist.item_ids = [(0, 0, {
+            'applied_on': '0_product_variant', 'product_id': self.product_a.id,
+            'compute_price': 'fixed', 'fixed_price': 70.0, 'date_end': today + timedelta(days=1),
+        })]
+        self.assertEqual(self.pricelist._get_agent_price_table_dated_product_ids(), set(self.products.ids))
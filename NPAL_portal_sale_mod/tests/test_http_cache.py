@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import HttpCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestAgentHttpCache(HttpCase):
+    """Le pagine agente con ETag rispondono 304 a una richiesta ripetuta con If-None-Match."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.agent_user = cls.env['res.users'].create({
+            'name': 'Agente Cache',
+            'login': 'npal_cache_agent',
+            'password': 'npal_cache_agent',
+            'groups_id': [(6, 0, [cls.env.ref('base.group_portal').id])],
+        })
+        # I clienti dell'agente sono i partner con lo stesso venditore del partner agente
+        cls.agent_user.partner_id.user_id = cls.agent_user
+        cls.customer = cls.env['res.partner'].create({'name': 'Cliente Cache', 'user_id': cls.agent_user.id})
+
+    def _get_etag(self, url, headers=None):
+        response = self.url_open(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers.get('ETag'))
+        return response.headers['ETag']
+
+    def _assert_not_modified(self, url):
+        etag = self._get_etag(url)
+        response = self.url_open(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers.get('ETag'), etag)
+
+    def test_my_customers_not_modified(self):
+        self.authenticate(self.agent_user.login, self.agent_user.login)
+        self._assert_not_modified('/my/customers')
+
+    def test_warehouses_not_modified(self):
+        if 'stock.warehouse' not in self.env:
+            self.skipTest("Modulo stock non installato")
+        self.authenticate(self.agent_user.login, self.agent_user.login)
+        self._assert_not_modified('/shop/agent/warehouses')
+
+    def test_new_session_invalidates_etag(self):
+        self.authenticate(self.agent_user.login, self.agent_user.login)
+        etag = self._get_etag('/my/customers')
+        self.authenticate(self.agent_user.login, self.agent_user.login)
+        response = self.url_open('/my/customers', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers.get('ETag'), etag)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+from unittest.mock import patch
+
+import psycopg2
+
+from odoo import SUPERUSER_ID, api
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import config
+
+from ..controllers.main import CATALOGUE_TOKEN_OVERLAP
+from ..tools import read_replica
+from ..tools.read_replica import (
+    REPLICA_CHECK_INTERVAL,
+    REPLICA_DSN_OPTION,
+    REPLICA_MAX_LAG_LIMIT,
+    REPLICA_MAX_LAG_OPTION,
+    get_max_lag,
+    get_replica_dsn,
+    replica_read,
+    replica_summary,
+    reset_replica_summary,
+)
+
+
+@tagged('post_install', '-at_install')
+class TestReadReplicaSettings(TransactionCase):
+    """Impostazioni della replica di lettura, senza replica configurata."""
+
+    def test_max_lag_clamped_below_catalogue_overlap(self):
+        self.assertLess(REPLICA_MAX_LAG_LIMIT, CATALOGUE_TOKEN_OVERLAP.total_seconds())
+        with patch.dict(config.options, {REPLICA_MAX_LAG_OPTION: '3600'}):
+            self.assertEqual(get_max_lag(), REPLICA_MAX_LAG_LIMIT)
+
+    def test_without_dsn_reads_on_primary(self):
+        with patch.dict(config.options, {REPLICA_DSN_OPTION: ''}):
+            self.assertIs(replica_read(self.env, lambda env: env), self.env)
+
+
+@tagged('post_install', '-at_install', 'npal_replica')
+class TestReadReplica(TransactionCase):
+    """
+    Letture sulla replica reale: attivo solo con npal_agent_replica_dsn
+    configurata. I dati di prova vengono committati (la replica non vede la
+    transazione del test) ed eliminati a fine classe.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not get_replica_dsn(cls.env.cr.dbname):
+            raise unittest.SkipTest("%s non configurata" % REPLICA_DSN_OPTION)
+
+        with cls.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            cls.partner_id = env['res.partner'].create({'name': 'Cliente Test Replica'}).id
+        cls.addClassCleanup(cls._delete_committed_partner)
+
+    @classmethod
+    def _delete_committed_partner(cls):
+        with cls.registry.cursor() as cr:
+            api.Environment(cr, SUPERUSER_ID, {})['res.partner'].browse(cls.partner_id).unlink()
+
+    def setUp(self):
+        super().setUp()
+        read_replica._replica_state.clear()
+        reset_replica_summary()
+
+    def _read_partner_ids(self, env):
+        return env['res.partner'].search([('id', '=', self.partner_id)]).ids
+
+    def _wait_for_replica(self):
+        """Attende che la replica abbia applicato i dati committati (entro il ritardo massimo)."""
+        deadline = time.monotonic() + get_max_lag() + REPLICA_CHECK_INTERVAL
+        while replica_read(self.env, lambda env: env is not self.env and bool(self._read_partner_ids(env))) is not True:
+            if time.monotonic() > deadline:
+                self.fail("Replica non allineata entro %.1fs" % get_max_lag())
+            read_replica._replica_state.clear()
+            time.sleep(0.2)
+        reset_replica_summary()
+
+    def test_reads_committed_data_from_replica(self):
+        self._wait_for_replica()
+        self.assertEqual(replica_read(self.env, self._read_partner_ids), [self.partner_id])
+        self.assertEqual(replica_summary().get('replica'), 1)
+
+    def test_operational_error_retries_on_primary(self):
+        self._wait_for_replica()
+        envs = []
+
+        def read(env):
+            envs.append(env)
+            if len(envs) == 1:
+                raise psycopg2.OperationalError("replica caduta durante la lettura")
+            return self._read_partner_ids(env)
+
+        self.assertEqual(replica_read(self.env, read), [self.partner_id])
+        self.assertIsNot(envs[0], self.env)
+        self.assertIs(envs[1], self.env)
+        summary = replica_summary()
+        self.assertEqual(summary.get('unreachable'), 1)
+        self.assertFalse(summary.get('replica'))
+
+        # La replica resta esclusa fino alla verifica successiva
+        self.assertIs(replica_read(self.env, lambda env: env), self.env)
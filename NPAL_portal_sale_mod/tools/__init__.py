@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from . import agent_metrics
+from . import http_cache
+from . import single_flight
+from . import read_replica
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import functools
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from odoo import models
+
+_logger = logging.getLogger(__name__)
+
+# Numero di campioni conservati in memoria (per processo)
+METRICS_BUFFER_SIZE = 2000
+# Ogni quanti campioni di uno stesso punto viene scritta una riga di riepilogo
+METRICS_LOG_INTERVAL = 100
+METRICS_PERCENTILES = (50, 90, 95, 99)
+
+
+class AgentMetricSample(object):
+    """Misura di una singola chiamata di un punto strumentato."""
+
+    __slots__ = ('name', 'queries', 'sql_time', 'python_time', 'records', 'timestamp')
+
+    def __init__(self, name, records=0):
+        self.name = name
+        self.queries = 0
+        self.sql_time = 0.0
+        self.python_time = 0.0
+        self.records = records
+        self.timestamp = time.time()
+
+
+class AgentMetrics(object):
+    """
+    Ring buffer thread-safe delle misure di route e metodi del portale agenti.
+    Per ogni chiamata registra numero di query SQL, tempo SQL, tempo Python e
+    numero di record trattati; i contatori SQL sono quelli che Odoo mantiene
+    sul thread corrente (query_count/query_time).
+    """
+
+    def __init__(self, size=METRICS_BUFFER_SIZE):
+        self._samples = collections.deque(maxlen=size)
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @staticmethod
+    def _thread_counters():
+        current_thread = threading.current_thread()
+        if not hasattr(current_thread, 'query_count'):
+            current_thread.query_count = 0
+            current_thread.query_time = 0
+        return current_thread.query_count, current_thread.query_time
+
+    @contextmanager
+    def measure(self, name, records=0):
+        """Context manager che misura il blocco e registra il campione."""
+        sample = AgentMetricSample(name, records)
+        parent = getattr(self._local, 'sample', None)
+        self._local.sample = sample
+        query_count, query_time = self._thread_counters()
+        start = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            elapsed = time.perf_counter() - start
+            end_count, end_time = self._thread_counters()
+            sample.queries = end_count - query_count
+            sample.sql_time = end_time - query_time
+            sample.python_time = max(elapsed - sample.sql_time, 0.0)
+            self._local.sample = parent
+            self._record(sample)
+
+    def set_records(self, records):
+        """Imposta il numero di record trattati dalla misura in corso."""
+        sample = getattr(self._local, 'sample', None)
+        if sample is not None:
+            sample.records = records
+
+    def _record(self, sample):
+        with self._lock:
+            self._samples.append(sample)
+            self._counts[sample.name] += 1
+            log_summary = self._counts[sample.name] % METRICS_LOG_INTERVAL == 0
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(
+                'agent_metrics name=%s queries=%d sql_ms=%.1f python_ms=%.1f records=%d',
+                sample.name, sample.queries, sample.sql_time * 1000,
+                sample.python_time * 1000, sample.records,
+            )
+        if log_summary and _logger.isEnabledFor(logging.INFO):
+            _logger.info('agent_metrics_summary %s', json.dumps(self.summary(sample.name), sort_keys=True))
+
+    @staticmethod
+    def _percentiles(values):
+        # Percentile nearest-rank
+        values = sorted(values)
+        return {
+            'p%s' % percentile: values[max(math.ceil(len(values) * percentile / 100) - 1, 0)]
+            for percentile in METRICS_PERCENTILES
+        }
+
+    def summary(self, name=None):
+        """
+        Aggrega i campioni in memoria per punto strumentato: numero di chiamate
+        e percentili di query, tempo SQL/Python (ms) e record.
+        """
+        with self._lock:
+            samples = [sample for sample in self._samples if name is None or sample.name == name]
+
+        grouped = collections.defaultdict(list)
+        for sample in samples:
+            grouped[sample.name].append(sample)
+
+        result = {}
+        for sample_name, group in grouped.items():
+            result[sample_name] = {
+                'calls': len(group),
+                'total_calls': self._counts[sample_name],
+                'queries': self._percentiles([sample.queries for sample in group]),
+                'sql_ms': self._percentiles([round(sample.sql_time * 1000, 2) for sample in group]),
+                'python_ms': self._percentiles([round(sample.python_time * 1000, 2) for sample in group]),
+                'records': self._percentiles([sample.records for sample in group]),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+agent_metrics = AgentMetrics()
+
+
+def instrument(name):
+    """
+    Decoratore per route e metodi: misura ogni chiamata con agent_metrics.
+    Per i metodi dei modelli il numero di record è quello del recordset
+    restituito (create) o di self.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with agent_metrics.measure(name) as sample:
+                result = func(self, *args, **kwargs)
+                if isinstance(result, models.BaseModel):
+                    sample.records = len(result)
+                elif isinstance(self, models.BaseModel) and not sample.records:
+                    sample.records = len(self)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from odoo.http import request
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(*parts):
+    """ETag (debole) calcolato dai timbri di versione dati."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def assets_version():
+    """Versione del bundle frontend: cambia con l'aggiornamento dei moduli o la modifica degli asset."""
+    bundle = request.env['ir.qweb']._get_asset_bundle('web.assets_frontend')
+    return bundle.get_version('js'), bundle.get_version('css')
+
+
+def layout_version():
+    """
+    Parti del layout website che cambiano indipendentemente dal contenuto
+    della pagina (lingua, sito, cliente selezionato, quantità carrello,
+    utente) e dei moduli: sessione (una pagina in cache dopo un nuovo login
+    avrebbe moduli con un token CSRF non valido), registry e asset. Il token
+    CSRF stesso non va usato: contiene un timestamp e cambia a ogni chiamata.
+    L'id di sessione non compare in chiaro, l'ETag ne è un hash.
+    """
+    agent_context = request.env.user._get_agent_context()
+    return (
+        request.session.sid,
+        request.env.registry.registry_sequence,
+        assets_version(),
+        request.env.user.id,
+        request.env.user.write_date,
+        request.lang.code if request.lang else False,
+        request.website.id if getattr(request, 'website', None) else False,
+        agent_context.customer_id,
+        request.session.get('website_sale_cart_quantity'),
+    )
+
+
+def is_not_modified(etag):
+    """True se la copia del client (If-None-Match) corrisponde all'ETag."""
+    return request.httprequest.if_none_match.contains_weak(etag)
+
+
+def not_modified_response(etag):
+    response = request.make_response('', status=304)
+    return set_cache_headers(response, etag)
+
+
+def set_cache_headers(response, etag):
+    """Imposta ETag e Cache-Control: il client deve sempre rivalidare."""
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+from odoo import api, sql_db
+from odoo.http import request
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# Opzioni del file di configurazione di Odoo
+REPLICA_DSN_OPTION = 'npal_agent_replica_dsn'
+REPLICA_MAX_LAG_OPTION = 'npal_agent_replica_max_lag'
+REPLICA_DEFAULT_MAX_LAG = 5.0
+# Limite del ritardo configurabile: deve restare sotto la sovrapposizione dei
+# token del catalogo offline (CATALOGUE_TOKEN_OVERLAP, 5 minuti), altrimenti i
+# delta letti dalla replica potrebbero perdere modifiche
+REPLICA_MAX_LAG_LIMIT = 240.0
+# Validità (secondi) dell'ultima verifica del ritardo della replica
+REPLICA_CHECK_INTERVAL = 2.0
+# Chiave di sessione: fino a questo istante le letture dell'utente vanno sul primario
+REPLICA_PIN_SESSION_KEY = 'npal_replica_pin_until'
+
+_lock = threading.Lock()
+_pool = None
+_replica_state = {}
+# Letture servite per esito: replica, primary (non configurata o sessione fissata), lagging, unreachable
+_stats = collections.Counter()
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = sql_db.ConnectionPool(int(config['db_maxconn']), readonly=True)
+        return _pool
+
+
+def get_replica_dsn(dbname):
+    """DSN della replica per il database dato, o None se non configurata."""
+    dsn = config.get(REPLICA_DSN_OPTION)
+    if not dsn:
+        return None
+    connection_info = parse_dsn(dsn)
+    connection_info.setdefault('dbname', dbname)
+    connection_info.setdefault('application_name', 'odoo-agent-replica')
+    return connection_info
+
+
+def replica_summary():
+    """Letture servite dalla replica e ricadute sul primario, per esito (per processo)."""
+    with _lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    return dict(stats, total=total, hit_rate=round(stats.get('replica', 0) / total, 4) if total else 0.0)
+
+
+def reset_replica_summary():
+    with _lock:
+        _stats.clear()
+
+
+def _count(outcome):
+    with _lock:
+        _stats[outcome] += 1
+
+
+def get_max_lag():
+    """Ritardo massimo accettato (secondi), limitato a REPLICA_MAX_LAG_LIMIT."""
+    try:
+        max_lag = float(config.get(REPLICA_MAX_LAG_OPTION) or REPLICA_DEFAULT_MAX_LAG)
+    except ValueError:
+        return REPLICA_DEFAULT_MAX_LAG
+    return min(max_lag, REPLICA_MAX_LAG_LIMIT)
+
+
+def _get_state_key(dsn):
+    return tuple(sorted(dsn.items()))
+
+
+def _get_replication_lag(cr):
+    """Ritardo (secondi) della replica; 0 se allineata o se non è in recovery (istanza di test)."""
+    cr.execute("""
+        SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+               END
+    """)
+    return float(cr.fetchone()[0])
+
+
+def pin_primary(seconds=None):
+    """Dopo una scrittura dell'utente, legge dal primario per il tempo massimo di ritardo della replica."""
+    if request and request.session is not None:
+        request.session[REPLICA_PIN_SESSION_KEY] = time.time() + (seconds or get_max_lag())
+
+
+def _is_pinned():
+    return bool(request) and request.session is not None and \
+        request.session.get(REPLICA_PIN_SESSION_KEY, 0) > time.time()
+
+
+@contextmanager
+def replica_env(env):
+    """
+    Environment di sola lettura sulla replica, con stesso utente e contesto
+    di `env`; restituisce `env` stesso (primario) se la replica non è
+    configurata, non raggiungibile o in ritardo oltre il limite, se
+    l'utente ha appena scritto o durante i test. I record ottenuti valgono
+    solo dentro il blocco: all'esterno vanno usati ID o valori semplici.
+    """
+    dsn = get_replica_dsn(env.cr.dbname)
+    # Nei test i dati non sono committati: la replica non li vedrebbe
+    if not dsn or _is_pinned() or env.registry.in_test_mode():
+        if dsn:
+            _count('primary')
+        yield env
+        return
+
+    key = _get_state_key(dsn)
+    now = time.monotonic()
+    with _lock:
+        checked_at, outcome = _replica_state.get(key, (0.0, None))
+        check_lag = now - checked_at >= REPLICA_CHECK_INTERVAL
+        if check_lag:
+            # Verifica presa in carico da questo worker: gli altri usano l'esito precedente fino al nuovo
+            _replica_state[key] = (now, outcome)
+    if not check_lag and outcome != 'replica':
+        # Ultima verifica recente e negativa: nessun tentativo di connessione
+        _count(outcome or 'primary')
+        yield env
+        return
+
+    cr = None
+    try:
+        cr = sql_db.Connection(_get_pool(), dsn['dbname'], dsn).cursor()
+        if check_lag:
+            lag = _get_replication_lag(cr)
+            outcome = 'replica' if lag <= get_max_lag() else 'lagging'
+            if outcome == 'lagging':
+                _logger.info('[AGENT REPLICA] Replica in ritardo di %.1fs, letture sul primario', lag)
+    except psycopg2.Error as e:
+        _logger.warning('[AGENT REPLICA] Replica non raggiungibile, letture sul primario: %s', e)
+        outcome = 'unreachable'
+    if check_lag or outcome == 'unreachable':
+        with _lock:
+            _replica_state[key] = (now, outcome)
+    _count(outcome)
+
+    if outcome != 'replica':
+        if cr is not None:
+            cr.close()
+        yield env
+        return
+
+    try:
+        yield api.Environment(cr, env.uid, env.context, su=env.su)
+    finally:
+        try:
+            cr.close()
+        except psycopg2.Error:
+            # Connessione già caduta: il pool la scarta
+            pass
+
+
+def replica_read(env, func):
+    """
+    Esegue `func(read_env)` sulla replica di lettura (vedi replica_env) e ne
+    restituisce il risultato. Se la connessione alla replica cade durante
+    la lettura (OperationalError), la replica viene segnata come non
+    raggiungibile e `func` viene rieseguita sul primario. `func` deve
+    restituire ID o valori semplici, non record della replica.
+    """
+    with replica_env(env) as read_env:
+        if read_env is env:
+            return func(env)
+        try:
+            return func(read_env)
+        except psycopg2.OperationalError as e:
+            _logger.warning('[AGENT REPLICA] Lettura interrotta sulla replica, ripetuta sul primario: %s', e)
+            with _lock:
+                _replica_state[_get_state_key(get_replica_dsn(env.cr.dbname))] = (time.monotonic(), 'unreachable')
+                _stats['replica'] -= 1
+                _stats['unreachable'] += 1
+    return func(env)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# Ogni quante chiamate di uno stesso gruppo viene scritta una riga di riepilogo
+SINGLE_FLIGHT_LOG_INTERVAL = 100
+# Attesa massima (secondi) del calcolo in corso: oltre, il thread calcola da sé
+SINGLE_FLIGHT_WAIT_TIMEOUT = 10.0
+
+
+class SingleFlightError(Exception):
+    """Errore del calcolo condiviso, rilanciato in ogni thread in attesa (con l'originale come causa)."""
+
+
+class _Call(object):
+    """Calcolo in corso per una chiave: i thread in attesa ne condividono l'esito."""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalescenza delle richieste concorrenti (per processo): finché un calcolo
+    per una chiave è in corso, le altre richieste con la stessa chiave ne
+    attendono la fine e ne riusano il risultato (o l'eccezione) invece di
+    ripeterlo. Il risultato non viene conservato dopo la fine del calcolo:
+    deve essere un valore semplice, indipendente da cursore e ambiente.
+    Se il calcolo non termina entro `wait_timeout` secondi, chi attende
+    esegue il proprio.
+    """
+
+    def __init__(self, wait_timeout=SINGLE_FLIGHT_WAIT_TIMEOUT):
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counts = collections.defaultdict(collections.Counter)
+
+    def do(self, group, key, func):
+        """Esegue func() per (group, key), o attende il calcolo già in corso."""
+        call_key = (group, key)
+        with self._lock:
+            call = self._calls.get(call_key)
+            leader = call is None
+            if leader:
+                call = self._calls[call_key] = _Call()
+            counts = self._counts[group]
+            counts['calls'] += 1
+            counts['leaders' if leader else 'shared'] += 1
+            log_summary = counts['calls'] % SINGLE_FLIGHT_LOG_INTERVAL == 0
+
+        if log_summary and _logger.isEnabledFor(logging.INFO):
+            _logger.info('single_flight_summary %s', json.dumps(self.summary(group), sort_keys=True))
+
+        if not leader:
+            if not call.event.wait(self.wait_timeout):
+                with self._lock:
+                    counts['timeouts'] += 1
+                _logger.warning('single_flight: calcolo %s oltre %ss, eseguito localmente', group, self.wait_timeout)
+                return func()
+            if call.error is not None:
+                # Eccezione nuova per thread: traceback distinti, originale come causa
+                raise SingleFlightError(str(call.error)) from call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[call_key]
+            call.event.set()
+
+    def summary(self, group=None):
+        """Chiamate, calcoli eseguiti, risultati condivisi e hit rate per gruppo."""
+        with self._lock:
+            counts = {
+                name: dict(counter) for name, counter in self._counts.items()
+                if group is None or name == group
+            }
+        return {
+            name: {
+                'calls': counter.get('calls', 0),
+                'leaders': counter.get('leaders', 0),
+                'shared': counter.get('shared', 0),
+                'timeouts': counter.get('timeouts', 0),
+                'hit_rate': round(counter.get('shared', 0) / counter['calls'], 4) if counter.get('calls') else 0.0,
+            }
+            for name, counter in counts.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+single_flight = SingleFlight()